@@ -0,0 +1,183 @@
+'''
+Benchmark of HardConstraintMatcher on synthetic students and courses.
+
+    python benchmark.py                          #1k and 10k students
+    python benchmark.py --sizes 1k 10k 50k 200k --timeLimit 600
+    python benchmark.py --sizes 50k --backend scipy
+    python benchmark.py --sizes 200k --format csv  #or parquet, arrow, xlsx (default)
+    python benchmark.py --strengthen --presolve   #the strengthened formulation, presolved
+    python benchmark.py --threads 8 --cuts off    #solver settings (threads default to the CPUs available)
+    python benchmark.py --inputCache              #load through the matcher's input cache (a miss, then hits)
+
+Each size gets a seeded synthetic input, written once to data/benchmark and reused:
+    -course popularity is skewed (a few courses get most of the first choices)
+    -some students bullet vote (the same course for all three choices) or leave choices empty
+    -course maxs add up to a little more than the number of students, so the popular
+     courses fill up, and most courses have a min
+    -a few courses have a min above the number of students who chose them, so they can't run
+     (what --presolve closes, next to the identical bullet voters that --strengthen's symmetry rows pair up)
+Every run loads, builds, solves and outputs in its own process (so peak memory is its own),
+parsing the input files each time unless --inputCache is given,
+prints the phase timings and appends them to benchmark_history.jsonl with the date and commit,
+so runs can be compared over time.
+'''
+
+from numpy import argpartition, argsort, bincount, log, maximum, ones_like, sort, take_along_axis, where, zeros
+from numpy.random import default_rng
+from pandas import DataFrame
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from subprocess import run, DEVNULL
+from tempfile import TemporaryDirectory
+from json import dumps
+import contextlib
+import io
+import os
+
+from matcher import HardConstraintMatcher
+
+#Version of the synthetic inputs, in their file names and the history, changed whenever they're made differently
+inputVersion = 2
+
+#Number of students and courses for each benchmark size
+sizes = {"1k": (1000, 50), "10k": (10000, 200), "50k": (50000, 1000), "200k": (200000, 2000)}
+
+studentColumns = {"First_Name": "First Name", "Last_Name": "Last Name",
+                  "P1": "Preference 1", "P2": "Preference 2", "P3": "Preference 3"}
+courseColumns = {"Name": "Course Name", "Min": "Minimum", "Max": "Maximum"}
+
+def makeStudents(S, C, seed = 0, skew = 1.0, bulletVoting = 0.05, missingChoices = 0.03):
+    #Three different courses per student drawn by popularity (Zipf-like), with some bullet votes and blanks
+    rng = default_rng(seed)
+    popularity = 1 / (1 + rng.permutation(C))**skew
+    #Gumbel top-3 draws three courses without replacement in proportion to popularity,
+    #a block of students at a time to keep the keys small
+    choices = zeros((S, 3), dtype=int)
+    block = max(1, 10**7 // C)
+    for start in range(0, S, block):
+        keys = log(popularity) + rng.gumbel(size=(min(block, S - start), C))
+        top = argpartition(-keys, 2, axis=1)[:, :3]
+        order = argsort(-take_along_axis(keys, top, axis=1), axis=1)
+        choices[start:start + block] = take_along_axis(top, order, axis=1) + 1
+
+    bullet = rng.random(S) < bulletVoting
+    choices[bullet] = choices[bullet, :1]
+    missing = rng.random((S, 3)) < missingChoices
+    missing[:, 0] = False
+    choices = where(missing, 0, choices)
+
+    return DataFrame({"First Name": ["Student%d" % s for s in range(S)], "Last Name": ["Bench"]*S,
+                      "Preference 1": choices[:, 0], "Preference 2": choices[:, 1], "Preference 3": choices[:, 2]}), popularity
+
+def courseDemand(students, C):
+    #Number of students who chose each course (a bullet vote counts once)
+    choices = sort(students[["Preference 1", "Preference 2", "Preference 3"]].to_numpy(), axis=1)
+    first = ones_like(choices, dtype=bool)
+    first[:, 1:] = choices[:, 1:] != choices[:, :-1]
+    return bincount(choices[first & (choices > 0)] - 1, minlength=C)
+
+def makeCourses(S, C, popularity, demand, seed = 0, slack = 1.05, cantRun = 0.02):
+    #Maxs are half even and half by popularity, adding up to slack*S; mins are 20-50% of the max,
+    #and a cantRun share of the courses get a min above their demand
+    rng = default_rng(seed + 1)
+    share = 0.5/C + 0.5*popularity/popularity.sum()
+    maxs = maximum(1, (share*slack*S).round()).astype(int)
+    mins = (maxs*rng.uniform(0.2, 0.5, C)).round().astype(int)
+    mins[rng.random(C) < 0.1] = 0
+    short = rng.choice(C, max(1, round(cantRun*C)), replace=False)
+    mins[short] = demand[short] + 1
+    maxs[short] = maximum(maxs[short], mins[short])
+    return DataFrame({"Course Name": ["Course%d" % c for c in range(C)], "Minimum": mins, "Maximum": maxs})
+
+#How the inputs are written in each file format
+writers = {"xlsx": lambda data, fileLocation: data.to_excel(fileLocation, index=False),
+           "csv": lambda data, fileLocation: data.to_csv(fileLocation, index=False),
+           "parquet": lambda data, fileLocation: data.to_parquet(fileLocation, index=False),
+           "arrow": lambda data, fileLocation: data.to_feather(fileLocation)}
+
+def makeInput(size, seed = 0, fileFormat = "xlsx", directory = os.path.join("data", "benchmark")):
+    #Writes the students and courses of a size once, and returns their file locations
+    S, C = sizes[size]
+    studentsFile = os.path.join(directory, "Students_%s_seed%d_v%d.%s" % (size, seed, inputVersion, fileFormat))
+    coursesFile = os.path.join(directory, "Courses_%s_seed%d_v%d.%s" % (size, seed, inputVersion, fileFormat))
+    if not (os.path.exists(studentsFile) and os.path.exists(coursesFile)):
+        os.makedirs(directory, exist_ok=True)
+        students, popularity = makeStudents(S, C, seed)
+        writers[fileFormat](makeCourses(S, C, popularity, courseDemand(students, C), seed), coursesFile)
+        writers[fileFormat](students, studentsFile)
+    return studentsFile, coursesFile
+
+def runBenchmark(size, seed, solveOptions, fileFormat = "xlsx", matcherOptions = {}):
+    #Runs in its own process: load, build, solve and output, returning the phase timings
+    studentsFile, coursesFile = makeInput(size, seed, fileFormat)
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        matcher = HardConstraintMatcher(os.path.abspath(studentsFile), 0, studentColumns,
+                                        os.path.abspath(coursesFile), 0, courseColumns, **dict({"cacheDirectory": None}, **matcherOptions))
+        matcher.solve(**solveOptions)
+        with TemporaryDirectory() as outputDirectory:
+            workingDirectory = os.getcwd()
+            os.chdir(outputDirectory)
+            try:
+                matcher.outputResults()
+            finally:
+                os.chdir(workingDirectory)
+
+    report = matcher.report
+    build = sum(report.seconds(phase) for phase in ("preferences", "variables", "objective", "constraints", "matrix", "flow"))
+    peaks = [phase["peakMemoryMB"] for phase in report.phases if phase["peakMemoryMB"] is not None]
+    solverPeaks = [phase["solverPeakMemoryMB"] for phase in report.phases if phase["solverPeakMemoryMB"] is not None]
+    return {"size": size, "students": matcher.S, "courses": matcher.C, "seed": seed, "inputVersion": inputVersion, "format": fileFormat, "options": dict(matcherOptions, **solveOptions),
+            "load": report.seconds("load"), "build": build, "solve": report.seconds("solver"), "output": report.seconds("output"),
+            "peakMemoryMB": max(peaks) if peaks else None, "solverPeakMemoryMB": max(solverPeaks) if solverPeaks else None,
+            "status": report.status, "objectiveValue": report.objectiveValue, "mipGap": report.mipGap,
+            "inputCache": report.inputCache, "modelSize": report.modelSize, "solverStats": report.solverStats, "solverConfig": report.solverConfig}
+
+def currentCommit():
+    try:
+        return run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, stdin=DEVNULL).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark HardConstraintMatcher on synthetic inputs")
+    parser.add_argument("--sizes", nargs="+", default=["1k", "10k"], choices=list(sizes))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", default="xlsx", choices=list(writers))
+    parser.add_argument("--backend", default="pulp")
+    parser.add_argument("--timeLimit", type=float, default=None)
+    parser.add_argument("--strengthen", action="store_true")
+    parser.add_argument("--presolve", action="store_true")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--solverPresolve", default=None, choices=["on", "off"])
+    parser.add_argument("--cuts", default=None, choices=["on", "off"])
+    parser.add_argument("--inputCache", action="store_true")
+    parser.add_argument("--history", default="benchmark_history.jsonl")
+    arguments = parser.parse_args()
+
+    solveOptions = {"backend": arguments.backend}
+    if arguments.timeLimit is not None:
+        solveOptions["timeLimit"] = arguments.timeLimit
+    if arguments.threads is not None:
+        solveOptions["threads"] = arguments.threads
+    for name in ("solverPresolve", "cuts"):
+        if getattr(arguments, name) is not None:
+            solveOptions[name] = getattr(arguments, name) == "on"
+    matcherOptions = {name: True for name in ("strengthen", "presolve") if getattr(arguments, name)}
+    if arguments.inputCache:
+        matcherOptions["cacheDirectory"] = os.path.join("data", "benchmark", "cache")
+    date = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    commit = currentCommit()
+
+    print("%-6s %9s %9s %9s %9s %10s %10s %6s  %s" % ("size", "load", "build", "solve", "output", "peak MB", "solver MB", "cache", "status"))
+    for size in arguments.sizes:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(runBenchmark, size, arguments.seed, solveOptions, arguments.format, matcherOptions).result()
+        print("%-6s %8.2fs %8.2fs %8.2fs %8.2fs %10s %10s %6s  %s %s" % (
+            size, result["load"], result["build"], result["solve"], result["output"],
+            "%.0f" % result["peakMemoryMB"] if result["peakMemoryMB"] is not None else "-",
+            "%.0f" % result["solverPeakMemoryMB"] if result["solverPeakMemoryMB"] is not None else "-",
+            "/".join(sorted(set(result["inputCache"].values()))) or "-", result["status"], result["objectiveValue"]))
+        with open(arguments.history, mode='a', encoding='utf-8') as history_file:
+            history_file.write(dumps(dict(result, date=date, commit=commit), default=lambda value: value.item()) + "\n")
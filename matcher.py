@@ -47,9 +47,710 @@ What does a matcher do?
         -add a penalty term to the objective for each penalty variable
 '''
 
-from pandas import read_excel
-from csv import writer, QUOTE_MINIMAL
-from pulp import LpProblem, LpMaximize, getSolver, LpVariable, LpInteger, LpAffineExpression, LpConstraint, LpStatus, value
+from numpy import append, arange, argmin, argsort, array, asarray, bincount, broadcast_to, concatenate, flatnonzero, float64, full, inf, int8, int32, int64, isfinite, isin, lexsort, load, maximum, minimum, nonzero, ones, rint, save, searchsorted, split, unique, vstack, where, zeros
+from pandas import DataFrame, read_csv, read_excel, read_feather, read_parquet
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Process, Queue
+from queue import Empty
+from threading import Thread
+from collections import namedtuple
+from tempfile import mkstemp
+from time import perf_counter, sleep
+from contextlib import contextmanager, redirect_stdout
+from io import StringIO
+from json import dump, dumps
+from hashlib import sha256
+from pickle import HIGHEST_PROTOCOL
+import pickle
+import sys
+from importlib.util import find_spec
+from signal import SIGTERM
+import os
+import re
+from pulp import LpProblem, LpMaximize, getSolver, LpVariable, LpInteger, LpAffineExpression, LpConstraint, LpStatus, LpSolutionIntegerFeasible, value, lpSum
+
+class MatrixModel:
+    """
+    A mixed integer program stored as NumPy arrays, so it can be handed straight to a
+    solver without building PuLP expressions:
+        maximize objective @ x
+        subject to rowLower <= A @ x <= rowUpper and lower <= x <= upper
+    A is kept as COO triples (rowIndex, columnIndex, values) with int32 indexes, with each entry
+    appearing once, and columns and rows are added in blocks, each block returning the indexes
+    it was given.
+    """
+    
+    def __init__(self):
+        self.numColumns = 0
+        self.numRows = 0
+        self.objective, self.lower, self.upper, self.integer = [], [], [], []
+        self.rowLower, self.rowUpper = [], []
+        self.rowIndex, self.columnIndex, self.values = [], [], []
+    
+    def addColumns(self, objective, lower = 0, upper = 1, integer = True):
+        objective = asarray(objective, dtype=float64)
+        n = len(objective)
+        self.objective.append(objective)
+        self.lower.append(broadcast_to(asarray(lower, dtype=float64), (n,)))
+        self.upper.append(broadcast_to(asarray(upper, dtype=float64), (n,)))
+        self.integer.append(broadcast_to(asarray(int(integer), dtype=int8), (n,)))
+        columns = arange(self.numColumns, self.numColumns + n, dtype=int32)
+        self.numColumns += n
+        return columns
+    
+    def addEntries(self, rows, columns, values):
+        #Coefficients of new columns in rows that were already added (rows are indexes returned by addRows)
+        self.rowIndex.append(asarray(rows, dtype=int32))
+        self.columnIndex.append(asarray(columns, dtype=int32))
+        self.values.append(broadcast_to(asarray(values, dtype=float64), (len(self.columnIndex[-1]),)))
+    
+    def addRows(self, numRows, rows, columns, values, lower = -inf, upper = inf):
+        #rows are numbered from 0 to numRows-1 within the block
+        self.rowIndex.append((asarray(rows) + self.numRows).astype(int32))
+        self.columnIndex.append(asarray(columns, dtype=int32))
+        self.values.append(broadcast_to(asarray(values, dtype=float64), (len(self.columnIndex[-1]),)))
+        self.rowLower.append(broadcast_to(asarray(lower, dtype=float64), (numRows,)))
+        self.rowUpper.append(broadcast_to(asarray(upper, dtype=float64), (numRows,)))
+        rowIds = arange(self.numRows, self.numRows + numRows, dtype=int32)
+        self.numRows += numRows
+        return rowIds
+    
+    def columnArrays(self):
+        return (concatenate(self.objective), concatenate(self.lower),
+                concatenate(self.upper), concatenate(self.integer))
+    
+    def modelSize(self):
+        return {"variables": self.numColumns, "constraints": self.numRows, "nonzeros": sum(len(values) for values in self.values)}
+    
+    def rowArrays(self):
+        return (concatenate(self.rowIndex), concatenate(self.columnIndex), concatenate(self.values),
+                concatenate(self.rowLower), concatenate(self.rowUpper))
+    
+    def solveScipy(self, options = {}, relax = False):
+        #HiGHS through scipy, in process. relax = True solves the LP relaxation (no integer columns)
+        from scipy.optimize import milp, Bounds, LinearConstraint
+        from scipy.sparse import coo_array
+        
+        objective, lower, upper, integer = self.columnArrays()
+        rows, columns, values, rowLower, rowUpper = self.rowArrays()
+        A = coo_array((values, (rows, columns)), shape=(self.numRows, self.numColumns)).tocsr()
+        result = milp(-objective, integrality=0 if relax else integer, bounds=Bounds(lower, upper),
+                      constraints=LinearConstraint(A, rowLower, rowUpper), options=options)
+        self.bestBound = -result.mip_dual_bound if getattr(result, "mip_dual_bound", None) is not None else None
+        if relax and result.status == 0:
+            self.bestBound = -result.fun
+        self.solverStats = {"nodes": getattr(result, "mip_node_count", None), "gap": getattr(result, "mip_gap", None),
+                            "bestBound": self.bestBound, "message": result.message}
+        if result.x is None:
+            return {2: "Infeasible", 3: "Unbounded"}.get(result.status, "Not Solved"), None, None
+        #A time limit leaves the best solution found so far
+        status = {0: "Optimal", 1: "Feasible"}.get(result.status, "Undefined")
+        return status, -result.fun, result.x
+    
+    def solveHighs(self, timeLimit = None, gapRel = None, gapAbs = None, start = None, onImprovement = None, relax = False,
+                   threads = None, presolve = None):
+        #HiGHS through highspy, passed the arrays row-wise without scipy or a model file. start is
+        #(columns, values) of a starting solution that HiGHS completes, and onImprovement(objective, bound)
+        #is called for each better solution it finds. HiGHS has no switch for its cuts
+        import highspy
+        
+        objective, lower, upper, integer = self.columnArrays()
+        rows, columns, values, rowLower, rowUpper = self.rowArrays()
+        order = argsort(rows, kind="stable")
+        rowStarts = searchsorted(rows[order], arange(self.numRows)).astype(int32)
+        
+        highs = highspy.Highs()
+        highs.setOptionValue("output_flag", False)
+        highs.passModel(self.numColumns, self.numRows, len(values), int(highspy.MatrixFormat.kRowwise), int(highspy.ObjSense.kMaximize), 0.0,
+                        objective, lower, upper, rowLower, rowUpper, rowStarts, columns[order], values[order],
+                        zeros(self.numColumns, dtype=int32) if relax else integer.astype(int32))
+        if timeLimit is not None:
+            highs.setOptionValue("time_limit", float(timeLimit))
+        if gapRel is not None:
+            highs.setOptionValue("mip_rel_gap", float(gapRel))
+        if gapAbs is not None:
+            highs.setOptionValue("mip_abs_gap", float(gapAbs))
+        if threads is not None:
+            #The threads are shared by every Highs in the process, and only change with a new scheduler
+            highspy.Highs.resetGlobalScheduler(True)
+            highs.setOptionValue("threads", int(threads))
+        if presolve is not None:
+            highs.setOptionValue("presolve", "on" if presolve else "off")
+        if start is not None:
+            startColumns, startValues = start
+            highs.setSolution(len(startColumns), asarray(startColumns, dtype=int32), asarray(startValues, dtype=float64))
+        if onImprovement is not None:
+            highs.cbMipImprovingSolution.subscribe(
+                lambda event: onImprovement(event.data_out.objective_function_value, event.data_out.mip_dual_bound))
+        
+        highs.run()
+        modelStatus = highs.getModelStatus()
+        info = highs.getInfo()
+        hasSolution = info.primal_solution_status == highspy.SolutionStatus.kSolutionStatusFeasible
+        self.bestBound = objectiveValue = info.objective_function_value if hasSolution else None
+        #HiGHS gives an infinite bound and gap until it has a bound
+        if not relax and info.mip_node_count >= 0:
+            self.bestBound = info.mip_dual_bound if isfinite(info.mip_dual_bound) else None
+        self.solverStats = {"nodes": info.mip_node_count, "iterations": info.simplex_iteration_count,
+                            "gap": info.mip_gap if isfinite(info.mip_gap) else None,
+                            "bestBound": self.bestBound, "message": highs.modelStatusToString(modelStatus)}
+        if modelStatus == highspy.HighsModelStatus.kOptimal:
+            return "Optimal", objectiveValue, array(highs.getSolution().col_value)
+        if hasSolution:
+            return "Feasible", objectiveValue, array(highs.getSolution().col_value)
+        return {highspy.HighsModelStatus.kInfeasible: "Infeasible", highspy.HighsModelStatus.kUnbounded: "Unbounded"}.get(modelStatus, "Not Solved"), None, None
+    
+    def solveOrtools(self, solverName = "SCIP", timeLimit = None, gapRel = None, gapAbs = None, threads = None, presolve = None, cuts = None):
+        #Any MIP solver OR-Tools was built with (SCIP by default), in process
+        from ortools.linear_solver import pywraplp
+        
+        solver = pywraplp.Solver.CreateSolver(solverName)
+        if solver is None:
+            raise RuntimeError("OR-Tools has no %s solver" % solverName)
+        objective, lower, upper, integer = self.columnArrays()
+        rows, columns, values, rowLower, rowUpper = self.rowArrays()
+        infinity = solver.infinity()
+        
+        x = [solver.IntVar(l, u, "") if i else solver.NumVar(l, u, "")
+             for l, u, i in zip(lower.tolist(), upper.tolist(), integer.tolist())]
+        constraints = [solver.RowConstraint(max(l, -infinity), min(u, infinity), "")
+                       for l, u in zip(rowLower.tolist(), rowUpper.tolist())]
+        for r, c, v in zip(rows.tolist(), columns.tolist(), values.tolist()):
+            constraints[r].SetCoefficient(x[c], v)
+        for c, v in zip(flatnonzero(objective).tolist(), objective[objective != 0].tolist()):
+            solver.Objective().SetCoefficient(x[c], v)
+        solver.Objective().SetMaximization()
+        if timeLimit is not None:
+            solver.SetTimeLimit(int(timeLimit*1000))
+        parameters = pywraplp.MPSolverParameters()
+        if gapRel is not None:
+            parameters.SetDoubleParam(parameters.RELATIVE_MIP_GAP, gapRel)
+        if presolve is not None:
+            parameters.SetIntegerParam(parameters.PRESOLVE, parameters.PRESOLVE_ON if presolve else parameters.PRESOLVE_OFF)
+        if threads is not None:
+            solver.SetNumThreads(int(threads))
+        #OR-Tools only has a relative gap parameter and no cuts switch, SCIP takes them by name
+        scipParameters = ""
+        if gapAbs is not None:
+            scipParameters += "limits/absgap = %g\n" % gapAbs
+        if cuts is False:
+            scipParameters += "separating/maxrounds = 0\nseparating/maxroundsroot = 0\n"
+        if scipParameters and solverName == "SCIP":
+            solver.SetSolverSpecificParametersAsString(scipParameters)
+        
+        result = solver.Solve(parameters)
+        self.bestBound = None
+        self.solverStats = {"nodes": solver.nodes(), "iterations": solver.iterations(), "wallTime": solver.wall_time() / 1000}
+        if result not in (solver.OPTIMAL, solver.FEASIBLE):
+            return {solver.INFEASIBLE: "Infeasible", solver.UNBOUNDED: "Unbounded"}.get(result, "Not Solved"), None, None
+        status = "Optimal" if result == solver.OPTIMAL else "Feasible"
+        self.bestBound = solver.Objective().BestBound()
+        self.solverStats["bestBound"] = self.bestBound
+        return status, solver.Objective().Value(), array([variable.solution_value() for variable in x])
+
+def availableCpus():
+    #CPUs this process can use, and where that number came from: the container's cgroup CPU quota
+    #if it's lower, else the CPUs it's allowed to run on
+    cpus, source = os.cpu_count() or 1, "cpu_count"
+    if hasattr(os, "sched_getaffinity"):
+        cpus, source = len(os.sched_getaffinity(0)), "affinity"
+    quota = cgroupCpuQuota()
+    if quota is not None and quota < cpus:
+        cpus, source = max(1, int(quota)), "cgroup"
+    return cpus, source
+
+def cgroupCpuQuota(root = "/sys/fs/cgroup"):
+    #CPUs allowed by the cgroup quota (cpu.max in cgroup v2, cfs_quota_us/cfs_period_us in v1),
+    #None if there's no quota or no cgroups
+    try:
+        with open(os.path.join(root, "cpu.max")) as quota_file:
+            quota, period = quota_file.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as quota_file:
+            quota = int(quota_file.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as period_file:
+            period = int(period_file.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+def peakMemory():
+    #Peak resident memory in MB of this process, None where the resource module isn't available (Windows)
+    try:
+        from resource import getrusage, RUSAGE_SELF
+    except ImportError:
+        return None
+    scale = 1024*1024 if sys.platform == "darwin" else 1024
+    return getrusage(RUSAGE_SELF).ru_maxrss / scale
+
+def childPeakMemory():
+    #Largest peak resident memory in MB of the child processes running now (CBC), from their own
+    #VmHWM in /proc, which starts over when the solver is executed. None without /proc or children.
+    #(getrusage's RUSAGE_CHILDREN can't be used: on Linux it counts the Python process they were forked from)
+    peaks = []
+    try:
+        tasks = os.listdir("/proc/self/task")
+    except OSError:
+        return None
+    for task in tasks:
+        try:
+            with open("/proc/self/task/%s/children" % task) as children_file:
+                children = children_file.read().split()
+        except OSError:
+            continue
+        for child in children:
+            try:
+                with open("/proc/%s/status" % child) as status_file:
+                    peaks.extend(int(line.split()[1]) / 1024 for line in status_file if line.startswith("VmHWM:"))
+            except (OSError, ValueError):
+                pass
+    return max(peaks) if peaks else None
+
+class SolveReport:
+    """
+    Where a matcher spends its time and memory, from reading the input to writing the outputs.
+    Each phase (load, preferences, variables, objective, constraints, solver, output, ...) is
+    timed as it runs and the entries are kept in order, so a resolve() adds a second solver phase.
+    peakMemoryMB is the peak memory of the process at the end of the phase, memoryGrowthMB how
+    much the phase raised it, and solverPeakMemoryMB the peak of the CBC process, sampled while it
+    runs where there is a /proc (None otherwise).
+    
+    modelSize has the variables, constraints and nonzeros of the last model that was built, and
+    solverStats what the solver said about the last solve (nodes, iterations, cuts, root bound,
+    gap, ...). inputCache says whether each input file was a "hit" or a "miss" in the input cache.
+    presolve has what the presolve reductions removed, when they're turned on. solverConfig has
+    the solver settings of the last solve (backend, threads and where their number came from,
+    solver presolve and cuts) and how long the solver took with them.
+    Use toDict() or writeJson(fileLocation) to keep it.
+    """
+    
+    def __init__(self):
+        self.phases = []
+        self.modelSize = {}
+        self.solverStats = {}
+        self.status = None
+        self.objectiveValue = None
+        self.mipGap = None
+        self.inputCache = {}
+        self.presolve = {}
+        self.solverConfig = {}
+    
+    @contextmanager
+    def phase(self, name):
+        #Yields a dict for what the phase measures itself (solverPeakMemoryMB)
+        start = perf_counter()
+        startMemory = peakMemory()
+        measured = {}
+        try:
+            yield measured
+        finally:
+            memory = peakMemory()
+            self.phases.append(dict({"phase": name, "seconds": perf_counter() - start, "peakMemoryMB": memory,
+                                     "memoryGrowthMB": None if memory is None else memory - startMemory,
+                                     "solverPeakMemoryMB": None}, **measured))
+    
+    def seconds(self, name):
+        #Total time of every phase with that name
+        return sum(phase["seconds"] for phase in self.phases if phase["phase"] == name)
+    
+    def toDict(self):
+        return {"status": self.status, "objectiveValue": self.objectiveValue, "mipGap": self.mipGap,
+                "inputCache": self.inputCache, "presolve": self.presolve, "solverConfig": self.solverConfig, "phases": self.phases, "modelSize": self.modelSize, "solverStats": self.solverStats}
+    
+    def writeJson(self, fileLocation):
+        with open(fileLocation, mode='w', encoding='utf-8') as report_file:
+            dump(self.toDict(), report_file, indent=2, default=lambda value: value.item())
+    
+    def __str__(self):
+        lines = ["%-12s %9.3fs %s" % (phase["phase"], phase["seconds"],
+                                       "" if phase["peakMemoryMB"] is None else "%8.1f MB peak" % phase["peakMemoryMB"])
+                 for phase in self.phases]
+        lines.append("Model size: %s" % ", ".join("%s %s" % (key, value) for key, value in self.modelSize.items()))
+        lines.append("Solver stats: %s" % ", ".join("%s %s" % (key, value) for key, value in self.solverStats.items()))
+        if self.solverConfig:
+            lines.append("Solver config: %s" % ", ".join("%s %s" % (key, value) for key, value in self.solverConfig.items()))
+        if self.presolve:
+            lines.append("Presolve: %s" % ", ".join("%s %s" % (key, len(value) if isinstance(value, list) else value)
+                                                    for key, value in self.presolve.items()))
+        return "\n".join(lines)
+
+class MatchResults:
+    """
+    The solution of a matcher as tables, made by Matcher.results() and written by outputResults():
+        courses: one row per course with its first/second/third choice counts, weight, bounds
+                 and the number of students assigned
+        assignedStudents: every student with their course number(s), -1 for none
+        unassignedStudents: the students with no course
+        stats: number of students by type of assignment (first choice, ..., no assignment)
+    
+    write() saves every table as Output_<Name>.<format> in a directory, in any of the writers'
+    formats (csv, parquet, jsonl), or to the file-like objects given in streams, e.g.
+        results.write(streams = {"assignedStudents": io.StringIO()})
+    Parquet needs pyarrow and binary streams (io.BytesIO). In CSV the stats keep their
+    one-line-per-stat format; the other formats get a Stat, Fraction, Count, Students table.
+    """
+    
+    #File name of each table
+    outputNames = {"courses": "Output_Courses", "assignedStudents": "Output_Assigned_Students",
+                   "unassignedStudents": "Output_Unassigned_Students", "stats": "Output_Stats"}
+    
+    #Method that writes each file format
+    writers = {"csv": "writeCsv", "parquet": "writeParquet", "jsonl": "writeJsonLines"}
+    
+    #Rows written at a time by the CSV writer
+    chunkSize = 100000
+    
+    def __init__(self, courses, assignedStudents, unassignedStudents, stats, placementValue, numStudents):
+        self.courses = courses
+        self.assignedStudents = assignedStudents
+        self.unassignedStudents = unassignedStudents
+        self.stats = stats
+        self.placementValue = placementValue
+        self.S = numStudents
+    
+    def statLines(self):
+        return ['%s: %.5f (%d/%d)' % (name, float(count)/self.S, count, self.S) for name, count in self.stats.items()]
+    
+    def table(self, name):
+        if name == "stats":
+            return DataFrame({'Stat': list(self.stats), 'Fraction': [float(count)/self.S for count in self.stats.values()],
+                              'Count': list(self.stats.values()), 'Students': self.S})
+        return getattr(self, name)
+    
+    def write(self, outputDirectory = ".", fileFormat = "csv", streams = None):
+        if fileFormat not in self.writers:
+            raise ValueError("Unknown output format '%s', expected one of: %s" % (fileFormat, ", ".join(self.writers)))
+        writer = getattr(self, self.writers[fileFormat])
+        if streams is not None:
+            for name, stream in streams.items():
+                if name not in self.outputNames:
+                    raise ValueError("Unknown output '%s', expected one of: %s" % (name, ", ".join(self.outputNames)))
+                writer(name, stream)
+            return
+        os.makedirs(outputDirectory, exist_ok=True)
+        for name, fileName in self.outputNames.items():
+            writer(name, os.path.join(outputDirectory, "%s.%s" % (fileName, fileFormat)))
+    
+    def writeCsv(self, name, target):
+        if name == "stats":
+            DataFrame({'Stats': self.statLines()}).to_csv(target, index=False, header=False, encoding='utf-8', lineterminator='\n')
+        else:
+            self.table(name).to_csv(target, index=False, encoding='utf-8', lineterminator='\n', chunksize=self.chunkSize)
+    
+    def writeParquet(self, name, target):
+        self.table(name).to_parquet(target, index=False)
+    
+    def writeJsonLines(self, name, target):
+        self.table(name).to_json(target, orient="records", lines=True, force_ascii=False)
+
+#A better solution found while solving, passed to solve(onIncumbent = ...)
+Incumbent = namedtuple("Incumbent", ["objective", "gap", "elapsed"])
+
+def relativeGap(objective, bound):
+    #Gap between a solution and the best bound, relative to the solution as CBC and HiGHS report it
+    if objective is None or bound is None or not isfinite(bound):
+        return None
+    if objective == 0:
+        return 0.0 if bound == 0 else inf
+    return max(bound - objective, 0) / abs(objective)
+
+def solveSubMatcher(subMatcher, solver, backend, options):
+    #Runs in a worker process for Matcher.solve(decompose = True)
+    subMatcher.incumbents = []
+    subMatcher.solveStart = perf_counter()
+    getattr(subMatcher, subMatcher.backends[backend])(solver, **options)
+    return (subMatcher.status, subMatcher.objectiveValue, subMatcher.pairStudent, subMatcher.pairCourse, subMatcher.pairValues,
+            subMatcher.report)
+
+def raceSubMatcher(subMatcher, solver, backend, options, results):
+    #Runs for Matcher.solve(backend = "portfolio"), in its own process group so the solver
+    #processes it starts (CBC) can be stopped with it
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    try:
+        results.put((backend,) + solveSubMatcher(subMatcher, solver, backend, options))
+    except Exception as error:
+        results.put((backend, "Error: %s" % error, None, None, None, None, None))
+
+def stopProcess(process):
+    if process.is_alive() and hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+    process.terminate()
+    process.join()
+
+class LocalSearch:
+    """
+    Improves an assignment that keeps every course that runs within its bounds, without a solver,
+    keeping it within the bounds after every move:
+        -upgrade: a student moves to a better choice that has room
+        -ejection: a student takes the place of someone in a full course, who moves to another of
+         their choices (or to the first student's old course, which makes it a swap)
+        -open: a course that isn't running takes enough of the students who chose it to reach its
+         min, when that's worth more than where they are
+        -close: a course at its min that holds students back is closed, and they move to their
+         other choices or stay unassigned
+    The moves are tried over every student and course in passes until a pass finds nothing, or
+    until the deadline (a perf_counter time). pairs are ordered by student, as a Matcher's are.
+    At the start of each pass the members of each course that could move to another course with
+    room (movable), that could swap into another course (swappers), and that aren't there for their
+    first choice (lowMembers) are found with array operations and ordered by what moving them
+    loses, so an ejection only looks at those and stops at the first that loses too much.
+    """
+    
+    def __init__(self, pairStudent, pairCourse, pairWeight, courseMins, courseMaxs, numStudents, pairValues):
+        self.pairCourse = pairCourse.tolist()
+        self.pairWeight = pairWeight.tolist()
+        self.courseMins = asarray(courseMins, dtype=int64).tolist()
+        self.courseMaxs = asarray(courseMaxs, dtype=int64).clip(0).tolist()
+        C = len(self.courseMins)
+        
+        ends = searchsorted(pairStudent, arange(1, numStudents + 1)).tolist()
+        self.studentPairs = [range(start, end) for start, end in zip([0] + ends[:-1], ends)]
+        self.current = [-1]*numStudents
+        for p in flatnonzero(pairValues).tolist():
+            self.current[int(pairStudent[p])] = p
+        self.members = [set() for c in range(C)]
+        for student, p in enumerate(self.current):
+            if p >= 0:
+                self.members[self.pairCourse[p]].add(student)
+        byCourse = argsort(pairCourse, kind="stable")
+        courseEnds = searchsorted(pairCourse[byCourse], arange(1, C + 1)).tolist()
+        self.choosers = [pairStudent[byCourse[start:end]].tolist() for start, end in zip([0] + courseEnds[:-1], courseEnds)]
+        self.coursePairs = [byCourse[start:end].tolist() for start, end in zip([0] + courseEnds[:-1], courseEnds)]
+        self.pairStudentArray, self.pairCourseArray, self.pairWeightArray = asarray(pairStudent), asarray(pairCourse), asarray(pairWeight)
+        self.bestWeight = zeros(numStudents, dtype=int64)
+        maximum.at(self.bestWeight, self.pairStudentArray, self.pairWeightArray)
+        self.moves = 0
+    
+    def findEjectable(self):
+        #Finds, from the current assignment:
+        #  improvable: the students who could get a better choice
+        #  movable[c]: (loss, student) of the members of c who have another choice with room,
+        #              least loss first
+        #  lowMembers[c]: the members of c who aren't in their first choice, lowest weight first
+        #  swapperEntries: (loss, student) of the members of c who chose d, least loss first,
+        #                  in the range given by swappers[c*C + d]
+        C = len(self.members)
+        current = array(self.current, dtype=int64)
+        assigned = current >= 0
+        currentCourse = where(assigned, self.pairCourseArray[current], -1)
+        currentWeight = where(assigned, self.pairWeightArray[current], 0)
+        sizes = bincount(currentCourse[assigned], minlength=C)
+        self.improvable = flatnonzero(currentWeight < self.bestWeight).tolist()
+        joinable = (sizes < asarray(self.courseMaxs)) & ((sizes > 0) | (asarray(self.courseMins) <= 1))
+        
+        pairCurrentCourse = currentCourse[self.pairStudentArray]
+        other = (pairCurrentCourse >= 0) & (self.pairCourseArray != pairCurrentCourse)
+        pairLoss = currentWeight[self.pairStudentArray] - self.pairWeightArray
+        topWeight = self.pairWeightArray.max(initial=0)
+        pairs = flatnonzero(other & joinable[self.pairCourseArray])
+        pairs = pairs[lexsort((pairLoss[pairs], self.pairStudentArray[pairs]))]
+        pairs = pairs[unique(self.pairStudentArray[pairs], return_index=True)[1]]
+        students, loss = self.pairStudentArray[pairs], pairLoss[pairs]
+        order = lexsort((loss, currentCourse[students]))
+        ends = searchsorted(currentCourse[students][order], arange(1, C + 1))
+        self.movable = [list(zip(groupLoss.tolist(), group.tolist()))
+                        for groupLoss, group in zip(split(loss[order], ends[:-1]), split(students[order], ends[:-1]))]
+        students = flatnonzero(assigned & (currentWeight < topWeight))
+        order = lexsort((currentWeight[students], currentCourse[students]))
+        ends = searchsorted(currentCourse[students][order], arange(1, C + 1))
+        self.lowMembers = [group.tolist() for group in split(students[order], ends[:-1])]
+        
+        keys = pairCurrentCourse[other]*C + self.pairCourseArray[other]
+        order = lexsort((pairLoss[other], keys))
+        keys, keyStarts = unique(keys[order], return_index=True)
+        self.swapperEntries = list(zip(pairLoss[other][order].tolist(), self.pairStudentArray[other][order].tolist()))
+        self.swappers = dict(zip(keys.tolist(), zip(keyStarts.tolist(), keyStarts[1:].tolist() + [len(order)])))
+    
+    def weight(self, student):
+        p = self.current[student]
+        return self.pairWeight[p] if p >= 0 else 0
+    
+    def course(self, student):
+        p = self.current[student]
+        return self.pairCourse[p] if p >= 0 else -1
+    
+    def canLeave(self, c):
+        #One student can leave course c (it stays at its min, or it empties and stops running)
+        return c < 0 or len(self.members[c]) - 1 >= self.courseMins[c] or len(self.members[c]) == 1
+    
+    def canJoin(self, c):
+        size = len(self.members[c])
+        return size < self.courseMaxs[c] and (size > 0 or self.courseMins[c] <= 1)
+    
+    def move(self, student, p):
+        #p is one of the student's pairs, or -1 to leave them unassigned
+        old = self.course(student)
+        if old >= 0:
+            self.members[old].discard(student)
+        self.current[student] = p
+        if p >= 0:
+            self.members[self.pairCourse[p]].add(student)
+        self.moves += 1
+    
+    def improveStudent(self, student):
+        old = self.course(student)
+        for p in self.studentPairs[student]:
+            gain = self.pairWeight[p] - self.weight(student)
+            c = self.pairCourse[p]
+            if gain <= 0 or c == old:
+                continue
+            if self.canJoin(c) and self.canLeave(old):
+                self.move(student, p)
+                return True
+            if len(self.members[c]) >= self.courseMaxs[c] and self.ejectFrom(student, p, gain):
+                return True
+        return False
+    
+    def ejectFrom(self, student, p, gain):
+        #student takes a place in the full course of p if someone there can move for less than gain.
+        #Members that left the course or have nowhere to go are dropped from the lists as they're found
+        c, old = self.pairCourse[p], self.course(student)
+        members = self.members[c]
+        #Only a swap keeps the size of a course that can't lose the student
+        canLeave = self.canLeave(old)
+        start, end = self.swappers.get(c*len(self.members) + old, (0, 0)) if old >= 0 else (0, 0)
+        swappers = self.swapperEntries[start:end]
+        for candidates in ((swappers, self.movable[c]) if canLeave else (swappers,)):
+            dropped = []
+            moved = False
+            for i, (loss, other) in enumerate(candidates):
+                if loss >= gain:
+                    break
+                if other not in members or other in self.stuck:
+                    dropped.append(i)
+                elif self.ejectMember(student, p, other, gain):
+                    moved = True
+                    break
+            for i in reversed(dropped):
+                del candidates[i]
+            if moved:
+                return True
+        #Or the member of c with the lowest weight there is left unassigned
+        if canLeave:
+            lowMembers = self.lowMembers[c]
+            while len(lowMembers) > 0 and lowMembers[0] not in members:
+                lowMembers.pop(0)
+            for other in lowMembers:
+                if other not in members:
+                    continue
+                if self.pairWeight[self.current[other]] >= gain:
+                    break
+                self.move(other, -1)
+                self.move(student, p)
+                return True
+        return False
+    
+    def ejectMember(self, student, p, other, gain):
+        #other moves from the course of p to another of their choices to make room for student
+        c, old = self.pairCourse[p], self.course(student)
+        otherWeight = self.pairWeight[self.current[other]]
+        canMove = False
+        for q in self.studentPairs[other]:
+            d = self.pairCourse[q]
+            if d == c:
+                continue
+            canJoin = self.canJoin(d)
+            canMove |= canJoin
+            if gain + self.pairWeight[q] - otherWeight <= 0:
+                continue
+            #Moving into the course the student leaves is a swap, and keeps its size
+            if d == old or (canJoin and self.canLeave(old)):
+                self.move(other, q)
+                self.move(student, p)
+                return True
+        #Members with nowhere to go are skipped for the rest of the pass
+        if not canMove:
+            self.stuck.add(other)
+        return False
+    
+    def openCourse(self, c):
+        #The students who gain the most (or lose the least) from moving into c, within what their courses can give up
+        if len(self.members[c]) > 0 or len(self.choosers[c]) < max(self.courseMins[c], 1):
+            return False
+        candidates = sorted(((self.pairWeight[p] - self.weight(student), student, p)
+                             for student, p in zip(self.choosers[c], self.coursePairs[c])), reverse=True)
+        room = {}
+        chosen = []
+        for gain, student, p in candidates:
+            old = self.course(student)
+            if old >= 0:
+                room.setdefault(old, len(self.members[old]) - self.courseMins[old])
+                if room[old] <= 0:
+                    continue
+                room[old] -= 1
+            chosen.append((gain, student, p))
+            if len(chosen) == self.courseMaxs[c]:
+                break
+        if len(chosen) < max(self.courseMins[c], 1):
+            return False
+        #The best number of students to take, at least the min
+        total = best = sum(gain for gain, student, p in chosen[:self.courseMins[c]])
+        take = max(self.courseMins[c], 1)
+        for k in range(take, len(chosen)):
+            total += chosen[k][0]
+            if total > best:
+                best, take = total, k + 1
+        if best <= 0:
+            return False
+        for gain, student, p in chosen[:take]:
+            self.move(student, p)
+        return True
+    
+    def closeCourse(self, c):
+        #Moves everyone out of c to their best other choice that can take them, if that gains
+        students = list(self.members[c])
+        if len(students) == 0 or len(students) > self.courseMins[c]:
+            return False
+        added = {}
+        gain = 0
+        plan = []
+        for student in students:
+            best = (0, -1)
+            for q in self.studentPairs[student]:
+                d = self.pairCourse[q]
+                size = len(self.members[d]) + added.get(d, 0)
+                if d != c and 0 < size < self.courseMaxs[d] and self.pairWeight[q] > best[0]:
+                    best = (self.pairWeight[q], q)
+            gain += best[0] - self.weight(student)
+            plan.append((student, best[1]))
+            if best[1] >= 0:
+                added[self.pairCourse[best[1]]] = added.get(self.pairCourse[best[1]], 0) + 1
+        if gain <= 0:
+            return False
+        for student, q in plan:
+            self.move(student, q)
+        return True
+    
+    def run(self, deadline = None, onImprovement = None):
+        #Passes over the students and courses until nothing improves, calling onImprovement after each pass that did
+        improved = True
+        while improved:
+            improved = False
+            self.findEjectable()
+            self.stuck = set()
+            for i, student in enumerate(self.improvable):
+                improved |= self.improveStudent(student)
+                if deadline is not None and i % 1000 == 0 and perf_counter() > deadline:
+                    return
+            for c in range(len(self.members)):
+                improved |= self.openCourse(c)
+                improved |= self.closeCourse(c)
+            if improved and onImprovement is not None:
+                onImprovement()
+            if deadline is not None and perf_counter() > deadline:
+                return
+    
+    def pairValues(self):
+        values = zeros(len(self.pairCourse), dtype=int8)
+        values[[p for p in self.current if p >= 0]] = 1
+        return values
 
 class Matcher:
     """
@@ -76,8 +777,115 @@ class Matcher:
         )
         matcher.solve() #this is the step that takes a long time
         matcher.outputResults()
+    
+    The input files can be Excel, CSV, Parquet or Arrow (by extension, see readers), and only
+    the named columns are read. The columns read from Excel and CSV files are cached as Arrow
+    files in cacheDirectory (".tas_cache", None to turn it off), by a hash of the file contents,
+    the sheet and the columns, so the next run with the same input skips parsing. The least
+    recently used are removed when the cache is over cacheSize MB. Needs pyarrow.
+    
+    With cacheModels = True the PuLP model that initProblem builds is pickled to cacheDirectory
+    too, with the pair arrays and the variables and constraints of each student and course, by a
+    hash of the choices, the course sizes, the matcher type and its options (modelFingerprint).
+    A later run on the same input loads it instead of building it again, whatever solver options
+    it uses, and can still change it in place and resolve().
+    
+    By default the model is sparse: variables are only made for each student's
+    P1/P2/P3 courses, so the model has at most 3*S assignment variables instead
+    of S*C. Pass sparse = False to build the full S*C grid of variables.
+    strengthen = True adds cuts that tighten the LP relaxation of the course size constraints
+    (see HardConstraintMatcher), so the branch and bound has less to do on hard rosters.
+    presolve = True reduces the problem before the model is built: the choices of courses that
+    not enough students chose to reach their min are dropped (closedCourses), so students who only
+    chose those courses have no choices left (unassignableStudents), and a course that fewer
+    students chose than its max can't fill up, so its max row only needs that many. What it
+    removed is printed and kept in report.presolve.
+    
+    The preferred pairs are the model's compact store: pairStudent and pairCourse (int32),
+    pairRank and pairWeight (int8), one entry per student choice, and the models, warm starts and
+    results are built from them. With storeDirectory = "folder" they are written there and memory
+    mapped instead of held in memory, for rosters close to the memory limit.
+    
+    solve(backend = "scipy") skips PuLP: the model is built as a MatrixModel straight
+    from the preference arrays and solved in process by HiGHS through scipy. solve(backend = "highs")
+    passes the same arrays to HiGHS's own Python bindings (highspy), which also takes a warmStart
+    and reports each better solution to onIncumbent while it runs.
+    
+    solve(warmStart = ...) gives CBC a starting solution: "greedy" for a first-choice pass
+    that respects the course bounds, or the location of a previous
+    Output_Assigned_Students.csv (made feasible and filled in with the same greedy pass).
+    
+    solve(mode = "relax-and-round") is a fast preview: it solves the LP relaxation of the model
+    (backend "pulp", "scipy" or "highs"), keeps each student's choice that the LP gives more than half of,
+    and repairs that into a feasible assignment with the greedy pass. The LP objective is an upper
+    bound on the optimum, so mipGap says how far the preview can be from optimal at most.
+    
+    solve(backend = "heuristic") needs no solver at all: the greedy pass followed by a local
+    search (see LocalSearch) that moves, swaps and ejects students and opens and closes courses
+    while every course that runs stays within its bounds, until nothing improves or timeLimit
+    runs out. Its bound is every student getting their best choice, so it is only Optimal when
+    that happens.
+    
+    solve(timeLimit = seconds) stops the solver at the time limit with the best solution it
+    has found, and the status is then "Feasible" instead of "Optimal". solve(gapRel = 0.01) or
+    solve(gapAbs = 5) stops as soon as the solution is proven within 1% (or 5 points) of the
+    best possible objective. mipGap is the relative gap of the final solution when the solver
+    gives a bound (0 for a proven optimum).
+    
+    solve(onIncumbent = callback) calls callback(Incumbent(objective, gap, elapsed)) each time a
+    better solution is found, with its gap to the best bound so far (None if there isn't one
+    yet) and the seconds since solve() started; incumbents keeps the list. CBC's incumbents are
+    streamed from its log while it runs; the other backends report their final solution.
+    
+    solve(backend = "portfolio") races the installed solvers (CBC through PuLP, HiGHS through
+    scipy, SCIP through OR-Tools, and any heuristic backend of the matcher) on the same
+    problem in separate processes. The first one to prove optimality wins and the others are
+    stopped; with a timeLimit the best solution found wins. portfolioWinner is its backend.
+    
+    After a PuLP solve the same matcher can be changed and solved again without rebuilding:
+        s = matcher.addStudent("First", "Last", 3, 7, 12)
+        matcher.updateStudent(s, 7, 3, 0)
+        matcher.updateCourseBounds(4, courseMin = 10, courseMax = 40)
+        matcher.removeCourse(9)
+        matcher.resolve() #starts from the last solution
+        matcher.outputResults()
+    Students and courses are indexes (from 0) and choices are course numbers (from 1) as in
+    the input files. Only the variables, constraints and objective terms of what changed are
+    touched in a sparse model; a dense model is rebuilt by resolve().
+    
+    solve(decompose = True) splits the students and courses into the connected components
+    of the preference graph and solves each one as its own smaller problem in a pool of
+    worker processes (one per CPU by default). Small components are solved
+    together so each worker gets at least minGroupPairs preferences, and a warmStart is split
+    between the groups. On Windows, a script
+    that uses this has to call solve() under if __name__ == "__main__":
+    
+    solve(threads = n, solverPresolve = False, cuts = False) sets the solver's threads and turns
+    its presolve and cuts on or off (None leaves the solver's default). CBC takes all three,
+    HiGHS threads and presolve, scipy presolve, and SCIP all three. By default the threads are
+    every CPU the process can use, from its CPU affinity or its container's cgroup quota if that
+    is lower, shared out between the solves of decompose and portfolio, or between
+    parallelSolves = n solves started side by side (runScenarios does this). report.solverConfig
+    records the settings used and how long the solver took with them.
     """
     
+    #Objective weight of a student's first, second and third choice
+    preferenceWeights = (5, 3, 1)
+    
+    #Set by solve(onIncumbent = ...), and the best bound on the objective that the solver proved
+    onIncumbent = None
+    bestBound = None
+    
+    #Directory of the memory mapped pair arrays, None to keep them in memory
+    storeDirectory = None
+    
+    #Build the strengthened formulation (see HardConstraintMatcher), and reduce the problem first
+    strengthen = False
+    presolve = False
+    
+    #Keep built PuLP models in cacheDirectory
+    cacheModels = False
+    
     def __init__(self,
             # Default Inputs
             students_FileLocation = 'data\MOCK_Students.xlsx',
@@ -95,257 +903,1177 @@ class Matcher:
                 "Name": "Course Name",
                 "Min": "Test Min",
                 "Max": "Test Max"
-            }
+            },
+            sparse = True,
+            cacheDirectory = ".tas_cache",
+            cacheSize = 512,
+            storeDirectory = None,
+            strengthen = False,
+            presolve = False,
+            cacheModels = False
         ):
+        self.report = SolveReport()
+        self.cacheDirectory = cacheDirectory
+        self.cacheSize = cacheSize
+        self.cacheModels = cacheModels
+        with self.report.phase("load"):
+            self.readInput(students_FileLocation, students_SheetName, students_Columns,
+                           courses_FileLocation, courses_SheetName, courses_Columns)
         
-        # Open Excel File
-        studentsData = read_excel(students_FileLocation, 
-                                     sheet_name = students_SheetName)
-        coursesData = read_excel(courses_FileLocation, 
-                                    sheet_name = courses_SheetName)
+        self.sparse = sparse
+        self.storeDirectory = storeDirectory
+        self.strengthen = strengthen
+        self.presolve = presolve
+        self.model = None
+        self.pairValues = None
+    
+    #Method that reads each type of input file, by file extension
+    readers = {".xlsx": "readExcel", ".xlsm": "readExcel", ".xls": "readExcel", ".csv": "readCsv",
+               ".parquet": "readParquet", ".arrow": "readArrow", ".feather": "readArrow"}
+    
+    def readInput(self, students_FileLocation, students_SheetName, students_Columns,
+                  courses_FileLocation, courses_SheetName, courses_Columns):
+        # Open the input files, reading only the columns that are used
+        studentsData = self.readTable(students_FileLocation, students_SheetName, students_Columns)
+        coursesData = self.readTable(courses_FileLocation, courses_SheetName, courses_Columns)
+        #Kept so that other columns of the courses file can be read later (see runScenarios)
+        self.coursesTable = (courses_FileLocation, courses_SheetName)
         
-        # Read Column data
-        self.studentFirstName = studentsData[students_Columns["First_Name"]].tolist()
-        self.studentLastName = studentsData[students_Columns["Last_Name"]].tolist()
-        self.courseNames = coursesData[courses_Columns["Name"]].tolist()
+        # Read Column data as NumPy arrays (names are kept as Python objects)
+        self.studentFirstName = studentsData[students_Columns["First_Name"]].to_numpy(dtype=object, copy=True)
+        self.studentLastName = studentsData[students_Columns["Last_Name"]].to_numpy(dtype=object, copy=True)
+        self.courseNames = coursesData[courses_Columns["Name"]].to_numpy(dtype=object, copy=True)
         self.S = len(self.studentFirstName)
         self.C = len(self.courseNames)
         
-        self.studentFirstChoices = studentsData[students_Columns["P1"]].tolist()
-        self.studentSecondChoices = studentsData[students_Columns["P2"]].tolist()
-        self.studentThirdChoices = studentsData[students_Columns["P3"]].tolist()
-        self.courseMins = coursesData[courses_Columns["Min"]].tolist()
-        self.courseMaxs = coursesData[courses_Columns["Max"]].tolist()
+        #studentChoices[s] = [P1, P2, P3] course numbers, missing preferences are 0
+        choiceColumns = [students_Columns["P1"], students_Columns["P2"], students_Columns["P3"]]
+        self.studentChoices = studentsData[choiceColumns].fillna(0).to_numpy(dtype=int32, copy=True)
+        self.courseMins = coursesData[courses_Columns["Min"]].to_numpy(dtype=int64, copy=True)
+        self.courseMaxs = coursesData[courses_Columns["Max"]].to_numpy(dtype=int64, copy=True)
+    
+    #Readers that are slow enough for their tables to be cached, and the cache format version
+    cachedReaders = ("readExcel", "readCsv")
+    cacheVersion = 1
+    
+    def readTable(self, fileLocation, sheetName, columns):
+        #The named columns of a students or courses file, read by the reader for its extension,
+        #or from the input cache if the same columns of the same file were read before
+        extension = os.path.splitext(str(fileLocation))[1].lower()
+        if extension not in self.readers:
+            raise ValueError("Can't read '%s', expected one of: %s" % (fileLocation, ", ".join(self.readers)))
+        reader = self.readers[extension]
+        columns = list(dict.fromkeys(columns.values()))
+        
+        cacheFile = self.cacheFile(fileLocation, reader, sheetName, columns)
+        if cacheFile is not None and os.path.exists(cacheFile):
+            #Touched on every hit, so eviction removes the least recently used tables first
+            os.utime(cacheFile)
+            self.report.inputCache[str(fileLocation)] = "hit"
+            return read_feather(cacheFile)
+        table = getattr(self, reader)(fileLocation, sheetName, columns)
+        if cacheFile is not None:
+            self.writeCache(table, cacheFile)
+            self.report.inputCache[str(fileLocation)] = "miss"
+        return table
+    
+    def cacheFile(self, fileLocation, reader, sheetName, columns):
+        #Arrow file named by a hash of the file contents, the sheet and the columns read,
+        #None if caching is off, the reader is fast anyway or pyarrow isn't installed
+        if self.cacheDirectory is None or reader not in self.cachedReaders or find_spec("pyarrow") is None:
+            return None
+        key = sha256(dumps([self.cacheVersion, reader, sheetName, columns]).encode())
+        with open(fileLocation, mode='rb') as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b""):
+                key.update(block)
+        return os.path.join(self.cacheDirectory, key.hexdigest() + ".arrow")
+    
+    def writeCache(self, table, cacheFile):
+        os.makedirs(self.cacheDirectory, exist_ok=True)
+        try:
+            #Written under another name first so a reader never sees half a file
+            table.reset_index(drop=True).to_feather(cacheFile + ".tmp")
+            os.replace(cacheFile + ".tmp", cacheFile)
+        except Exception as error:
+            #Columns Arrow can't store (mixed types) are just not cached
+            print("Input not cached: %s" % error)
+            if os.path.exists(cacheFile + ".tmp"):
+                os.remove(cacheFile + ".tmp")
+            return
+        self.evictCache()
+    
+    def evictCache(self):
+        #Removes the least recently used tables and models until the cache is within cacheSize MB
+        files = [os.path.join(self.cacheDirectory, name) for name in os.listdir(self.cacheDirectory) if name.endswith((".arrow", ".pickle"))]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(name) for name in files)
+        while files and total > self.cacheSize*1024*1024:
+            total -= os.path.getsize(files[0])
+            os.remove(files.pop(0))
+    
+    def readExcel(self, fileLocation, sheetName, columns):
+        return read_excel(fileLocation, sheet_name = sheetName, usecols = columns)
+    
+    def readCsv(self, fileLocation, sheetName, columns):
+        #pyarrow parses CSV in parallel when it's installed
+        return read_csv(fileLocation, usecols = columns, engine = "pyarrow" if find_spec("pyarrow") else "c")
+    
+    def readParquet(self, fileLocation, sheetName, columns):
+        return read_parquet(fileLocation, columns = columns)
+    
+    def readArrow(self, fileLocation, sheetName, columns):
+        #Arrow IPC (Feather v2) files
+        return read_feather(fileLocation, columns = columns)
+    
+    def makePreferences(self):
+        #studentChoiceIndex[s][r] is the course index of preference r (0, 1, 2) or -1 if there isn't one
+        #A student who bullet votes keeps the weight of their highest preference for that course
+        choices = self.studentChoices - 1
+        valid = (choices >= 0) & (choices < self.C)
+        valid[:, 1] &= choices[:, 1] != choices[:, 0]
+        valid[:, 2] &= (choices[:, 2] != choices[:, 0]) & (choices[:, 2] != choices[:, 1])
+        self.studentChoiceIndex = where(valid, choices, -1).astype(int32)
+        
+        #Preferred (student, course) pairs ordered by student then preference, with their objective weight
+        pairStudents, pairRanks = nonzero(valid)
+        self.pairStudent = pairStudents.astype(int32)
+        self.pairCourse = self.studentChoiceIndex[pairStudents, pairRanks]
+        self.pairRank = pairRanks.astype(int8)
+        self.pairWeight = array(self.preferenceWeights, dtype=int8)[pairRanks]
+        if self.presolve:
+            self.presolvePairs()
+        if self.storeDirectory is not None:
+            self.storeArrays(("studentChoiceIndex", "pairStudent", "pairCourse", "pairRank", "pairWeight"))
+    
+    def courseDemand(self):
+        #Number of students who chose each course
+        return bincount(self.pairCourse, minlength=self.C)
+    
+    def coursesThatCantRun(self):
+        #Courses that no assignment can use, made by each type of Matcher
+        return zeros(0, dtype=int64)
+    
+    def presolvePairs(self):
+        #Drops the pairs of the courses that can't run, before any model is built
+        closed = self.coursesThatCantRun()
+        hadChoices = bincount(self.pairStudent, minlength=self.S) > 0
+        keep = ~isin(self.pairCourse, closed)
+        numPairs = len(keep)
+        for name in ("pairStudent", "pairCourse", "pairRank", "pairWeight"):
+            setattr(self, name, getattr(self, name)[keep])
+        self.closedCourses = closed
+        self.unassignableStudents = flatnonzero(hadChoices & (bincount(self.pairStudent, minlength=self.S) == 0))
+        
+        demand = self.courseDemand()
+        nonBindingMaxs = flatnonzero((demand < asarray(self.courseMaxs)) & ~isin(arange(self.C), closed))
+        self.report.presolve = {"closedCourses": closed.tolist(), "unassignableStudents": self.unassignableStudents.tolist(),
+                                "removedPairs": numPairs - len(self.pairStudent), "pairs": len(self.pairStudent),
+                                "nonBindingMaxs": nonBindingMaxs.tolist()}
+        print("Presolve: %d courses can't reach their min, %d students can't be assigned, %d of %d choices removed, "
+              "%d course maxs can't be reached" % (len(closed), len(self.unassignableStudents), numPairs - len(self.pairStudent),
+                                                   numPairs, len(nonBindingMaxs)))
+    
+    def storeArrays(self, names):
+        #Moves arrays to .npy files in storeDirectory and keeps read-only memory maps of them, so
+        #the operating system can page them out. Each store is a new file, since Windows can't
+        #replace a file that is mapped. The older files of the array are removed: a map keeps using
+        #its file after that on POSIX, and on Windows a file that is still mapped is left for a later store
+        os.makedirs(self.storeDirectory, exist_ok=True)
+        for name in names:
+            handle, fileLocation = mkstemp(prefix=name + "-", suffix=".npy", dir=self.storeDirectory)
+            with os.fdopen(handle, mode='wb') as store_file:
+                save(store_file, getattr(self, name))
+            setattr(self, name, load(fileLocation, mmap_mode="r"))
+            for oldFile in os.listdir(self.storeDirectory):
+                if oldFile.startswith(name + "-") and oldFile.endswith(".npy") and oldFile != os.path.basename(fileLocation):
+                    try:
+                        os.remove(os.path.join(self.storeDirectory, oldFile))
+                    except OSError:
+                        pass
+    
+    def makeIndexes(self):
+        #Index of the (student, course) pairs that get a variable
+        if self.sparse:
+            studentEnds = bincount(self.pairStudent, minlength=self.S).cumsum()
+            self.studentCourses = [courses.tolist() for courses in split(self.pairCourse, studentEnds[:-1])]
+            byCourse = self.pairCourse.argsort(kind="stable")
+            courseEnds = bincount(self.pairCourse, minlength=self.C).cumsum()
+            self.courseStudents = [students.tolist() for students in split(self.pairStudent[byCourse], courseEnds[:-1])]
+        else:
+            self.studentCourses = [range(self.C) for s in range(self.S)]
+            self.courseStudents = [range(self.S) for c in range(self.C)]
     
     ##### The folowing 3 functions should be expanded upon for each type of Matcher #####
     def initVariables(self):
-        self.studentAssignments = [[LpVariable("S%dC%d"%(s,c), 0, 1, LpInteger) 
-                       for c in range(self.C)] for s in range(self.S)]
+        #studentAssignments[s][c] is a list over every course when dense, and a dict over studentCourses[s] when sparse
+        if self.sparse:
+            self.studentAssignments = [{c: LpVariable("S%dC%d"%(s,c), 0, 1, LpInteger) 
+                           for c in self.studentCourses[s]} for s in range(self.S)]
+        else:
+            self.studentAssignments = [[LpVariable("S%dC%d"%(s,c), 0, 1, LpInteger) 
+                           for c in range(self.C)] for s in range(self.S)]
     
     def makeObjective(self):
-        #Student preference vector (for the objective function)         
-        self.studentPreferences = [[0 for c in range(self.C)] for s in range(self.S)]
-        
-        for s in range(self.S):
-            coursePreferences = []
-            for c in range(self.C):
-                if (self.studentFirstChoices[s] == (c + 1)):
-                    coursePreferences.append(5)
-                elif (self.studentSecondChoices[s] == (c + 1)):
-                    coursePreferences.append(3)
-                elif (self.studentThirdChoices[s] == (c + 1)):
-                    coursePreferences.append(1)
-                else:
-                    coursePreferences.append(0)
-            self.studentPreferences[s] = coursePreferences
-        # for s in range(self.S):
-        #     c1 = (self.studentFirstChoices[s])-1
-        #     c2 = (self.studentSecondChoices[s])-1
-        #     c3 = (self.studentThirdChoices[s])-1
-        #     #students who bullet vote will have their single preference value be 1
-        #     self.studentPreferences[s][c1] = 5
-        #     self.studentPreferences[s][c2] = 3   
-        #     self.studentPreferences[s][c3] = 1
+        #Placement value of an assignment: 5*first + 3*second + third choices
+        self.objective = lpSum(weight*self.studentAssignments[s][c] for s, c, weight
+                               in zip(self.pairStudent.tolist(), self.pairCourse.tolist(), self.pairWeight.tolist()))
     
     def makeConstraints(self):
-        self.sumStudentsInClass = [LpAffineExpression() for c in range(self.C)]
-        for c in range(self.C):
-            for s in range(self.S):
-                self.sumStudentsInClass[c] += self.studentAssignments[s][c]
+        self.sumStudentsInClass = [lpSum(self.studentAssignments[s][c] for s in self.courseStudents[c])
+                                   for c in range(self.C)]
+    
+    #What initProblem makes, kept in the model cache (extended by each type of Matcher)
+    modelAttributes = ("model", "studentChoiceIndex", "pairStudent", "pairCourse", "pairRank", "pairWeight", "closedCourses",
+                       "unassignableStudents", "studentCourses", "courseStudents", "studentAssignments", "objective", "sumStudentsInClass")
+    
+    #Version of the models' formulation, changed whenever a model would be built differently so
+    #that cached models made by older code aren't used
+    modelVersion = 1
+    
+    def modelFingerprint(self):
+        #Hash of everything the model is built from: the choices, the course sizes, the matcher type and its options
+        key = sha256(dumps([self.cacheVersion, self.modelVersion, type(self).__name__, self.S, self.C,
+                            [repr(getattr(self, name)) for name in self.optionAttributes]]).encode())
+        for values in (self.studentChoices, self.courseMins, self.courseMaxs):
+            key.update(array(values, dtype=int64).tobytes())
+        return key.hexdigest()
+    
+    def modelCacheFile(self):
+        if not self.cacheModels or self.cacheDirectory is None:
+            return None
+        return os.path.join(self.cacheDirectory, "model-%s.pickle" % self.modelFingerprint())
+    
+    def loadModel(self, cacheFile):
+        #Restores what initProblem made from the model cache
+        os.utime(cacheFile)
+        with open(cacheFile, mode='rb') as model_file:
+            attributes, self.report.presolve = pickle.load(model_file)
+        for name, attribute in attributes.items():
+            setattr(self, name, attribute)
+        if self.storeDirectory is not None:
+            self.storeArrays(("studentChoiceIndex", "pairStudent", "pairCourse", "pairRank", "pairWeight"))
+    
+    def saveModel(self, cacheFile):
+        os.makedirs(self.cacheDirectory, exist_ok=True)
+        attributes = {name: getattr(self, name) for name in self.modelAttributes if hasattr(self, name)}
+        with open(cacheFile + ".tmp", mode='wb') as model_file:
+            pickle.dump((attributes, self.report.presolve), model_file, protocol=HIGHEST_PROTOCOL)
+        os.replace(cacheFile + ".tmp", cacheFile)
+        self.evictCache()
     
     def initProblem(self):
+        cacheFile = self.modelCacheFile()
+        if cacheFile is not None and os.path.exists(cacheFile):
+            with self.report.phase("model cache"):
+                self.loadModel(cacheFile)
+            self.report.inputCache["model"] = "hit"
+            self.report.modelSize = self.pulpModelSize()
+            return
+        self.buildProblem()
+        if cacheFile is not None:
+            with self.report.phase("model cache"):
+                self.saveModel(cacheFile)
+            self.report.inputCache["model"] = "miss"
+    
+    def buildProblem(self):
         self.model = LpProblem("TAS Matching", LpMaximize)
-        self.initVariables()
-        self.makeObjective()
-        self.makeConstraints()
+        with self.report.phase("preferences"):
+            self.makePreferences()
+            self.makeIndexes()
+        with self.report.phase("variables"):
+            self.initVariables()
+        with self.report.phase("objective"):
+            self.makeObjective()
+        with self.report.phase("constraints"):
+            self.makeConstraints()
+        self.report.modelSize = self.pulpModelSize()
     
-    def solve(self, solver = "PULP_CBC_CMD"):
-        self.initProblem()
+    def pulpModelSize(self):
+        return {"variables": self.model.numVariables(), "constraints": self.model.numConstraints(),
+                "nonzeros": sum(len(constraint) for constraint in self.model.constraints.values())}
+    
+    def makeMatrixModel(self):
+        #One column per preferred pair (pairValues), weighted by the placement value
+        self.matrix = MatrixModel()
+        self.pairColumns = self.matrix.addColumns(self.pairWeight)
+    
+    def initMatrixProblem(self):
+        with self.report.phase("preferences"):
+            self.makePreferences()
+        with self.report.phase("matrix"):
+            self.makeMatrixModel()
+        self.report.modelSize = self.matrix.modelSize()
+    
+    #Name of the method that solves the problem with each backend
+    backends = {"pulp": "solvePulp", "scipy": "solveScipy", "highs": "solveHighs", "ortools": "solveOrtools",
+                "portfolio": "solvePortfolio", "heuristic": "solveHeuristic"}
+    
+    #Backends raced by solve(backend = "portfolio"), and the package each one needs
+    portfolioBackends = {"pulp": "pulp", "scipy": "scipy", "ortools": "ortools", "heuristic": "numpy"}
+    
+    #PuLP solvers that run CBC, which take threads, presolve and cuts
+    cbcSolvers = ("PULP_CBC_CMD", "COIN_CMD")
+    
+    #Settings (not input data) that a subMatcher copies from its matcher
+    optionAttributes = ("sparse", "preferenceWeights", "strengthen", "presolve")
+    
+    #Name of the method that makes the LP relaxation's pair values with each backend, for mode = "relax-and-round"
+    relaxationBackends = {"pulp": "relaxPulp", "scipy": "relaxScipy", "highs": "relaxHighs"}
+    
+    def solve(self, solver = "PULP_CBC_CMD", backend = "pulp", decompose = False, workers = None, minGroupPairs = 1000,
+              onIncumbent = None, mode = "exact", threads = None, solverPresolve = None, cuts = None, parallelSolves = 1, **options):
+        if backend not in self.backends:
+            raise ValueError("Unknown backend '%s', expected one of: %s" % (backend, ", ".join(self.backends)))
+        if mode not in ("exact", "relax-and-round"):
+            raise ValueError("Unknown mode '%s', expected exact or relax-and-round" % mode)
+        if mode == "relax-and-round" and (decompose or backend not in self.relaxationBackends):
+            raise ValueError("mode relax-and-round needs one of the backends: %s, without decompose" % ", ".join(self.relaxationBackends))
+        self.onIncumbent = onIncumbent
+        self.incumbents = []
+        self.bestBound = None
+        self.solveStart = perf_counter()
+        self.report.solverStats = {}
+        
+        #Every CPU this process can use unless threads is given, shared out between the solves that
+        #run at the same time: parallelSolves of them (as in runScenarios), or those of decompose and portfolio
+        threadSource = "option"
+        if threads is None:
+            cpus, threadSource = availableCpus()
+            threads = max(1, cpus // parallelSolves)
+        self.report.solverConfig = {"backend": backend, "solver": solver if backend == "pulp" else None, "mode": mode, "threads": threads, "threadSource": threadSource,
+                                    "presolve": solverPresolve, "cuts": cuts, "parallelSolves": parallelSolves}
+        options = dict(options, threads = threads, autoThreads = threadSource != "option", solverPresolve = solverPresolve, cuts = cuts)
+        solverPhases = len(self.report.phases)
+        if mode == "relax-and-round":
+            self.solveRelaxAndRound(solver, backend, **options)
+        elif decompose:
+            self.solveDecomposed(solver, backend, workers, minGroupPairs, **options)
+        else:
+            getattr(self, self.backends[backend])(solver, **options)
+        self.report.solverConfig["seconds"] = sum(phase["seconds"] for phase in self.report.phases[solverPhases:] if phase["phase"] == "solver")
+        
+        #The final solution, if the backend didn't already report it
+        if self.status in ("Optimal", "Feasible"):
+            #A proven optimum is its own bound, whatever bound the solver reported on the way
+            if self.status == "Optimal":
+                self.bestBound = self.objectiveValue
+            if len(self.incumbents) == 0 or self.incumbents[-1].objective < self.objectiveValue:
+                self.reportIncumbent(self.objectiveValue)
+        self.mipGap = relativeGap(self.objectiveValue, self.bestBound)
+        self.report.status, self.report.objectiveValue, self.report.mipGap = self.status, self.objectiveValue, self.mipGap
+        print("Status:", self.status)
+        print("Objective value: ", self.objectiveValue)
+    
+    def shareThreads(self, options, parallelSolves):
+        #Divides the threads between solves that run at the same time, unless they were given
+        if options.get("autoThreads"):
+            options = dict(options, threads = max(1, options["threads"] // parallelSolves))
+        self.report.solverConfig.update(threads = options["threads"], parallelSolves = self.report.solverConfig.get("parallelSolves", 1)*parallelSolves)
+        return options
+    
+    def pulpSolverOptions(self, solver, threads = None, autoThreads = False, solverPresolve = None, cuts = None, **options):
+        #The settings PuLP passes to CBC on its command line. Other PuLP solvers may not take them,
+        #so they only get the ones that were given
+        if autoThreads and solver not in self.cbcSolvers:
+            threads = None
+        return {name: setting for name, setting in (("threads", threads), ("presolve", solverPresolve), ("cuts", cuts))
+                if setting is not None}
+    
+    def reportIncumbent(self, objective):
+        incumbent = Incumbent(objective, relativeGap(objective, self.bestBound), perf_counter() - self.solveStart)
+        self.incumbents.append(incumbent)
+        if self.onIncumbent is not None:
+            self.onIncumbent(incumbent)
+    
+    def findComponents(self):
+        #Connected components of the student-course preference graph that have any preferences,
+        #as (students, courses, number of pairs)
+        from scipy.sparse import coo_array
+        from scipy.sparse.csgraph import connected_components
+        
+        n = self.S + self.C
+        graph = coo_array((ones(len(self.pairStudent)), (self.pairStudent, self.S + self.pairCourse)), shape=(n, n))
+        labels = connected_components(graph, directed=False)[1]
+        pairLabels = labels[self.pairStudent]
+        usedLabels = unique(pairLabels)
+        pairCounts = bincount(pairLabels)[usedLabels]
+        
+        nodes = argsort(labels, kind="stable")
+        starts = searchsorted(labels[nodes], usedLabels)
+        ends = searchsorted(labels[nodes], usedLabels, side="right")
+        components = []
+        for start, end, pairCount in zip(starts, ends, pairCounts):
+            componentNodes = nodes[start:end]
+            components.append((componentNodes[componentNodes < self.S],
+                               componentNodes[componentNodes >= self.S] - self.S, int(pairCount)))
+        return components
+    
+    def subMatcher(self, students, courses):
+        #A matcher of the same type over some of the students and courses, renumbering the courses
+        subMatcher = type(self).__new__(type(self))
+        for name in self.optionAttributes:
+            setattr(subMatcher, name, getattr(self, name))
+        subMatcher.model = None
+        subMatcher.pairValues = None
+        subMatcher.report = SolveReport()
+        subMatcher.S = len(students)
+        subMatcher.C = len(courses)
+        subMatcher.studentFirstName = self.studentFirstName[students]
+        subMatcher.studentLastName = self.studentLastName[students]
+        subMatcher.courseNames = self.courseNames[courses]
+        subMatcher.courseMins = self.courseMins[courses]
+        subMatcher.courseMaxs = self.courseMaxs[courses]
+        
+        #Choices of courses outside of the sub matcher become 0 (no choice)
+        courseNumbers = zeros(self.C + 1, dtype=int64)
+        courseNumbers[asarray(courses) + 1] = arange(1, len(courses) + 1)
+        choices = self.studentChoices[students]
+        subMatcher.studentChoices = where((choices >= 1) & (choices <= self.C), courseNumbers[choices.clip(0, self.C)], 0).astype(int32)
+        return subMatcher
+    
+    def solveDecomposed(self, solver, backend, workers = None, minGroupPairs = 1000, **options):
+        self.makePreferences()
+        
+        #Largest components first, with the small ones put together until a group is big enough
+        groups = []
+        for students, courses, pairCount in sorted(self.findComponents(), key=lambda component: -component[2]):
+            if len(groups) == 0 or groups[-1][2] >= minGroupPairs:
+                groups.append(([], [], 0))
+            groups[-1][0].append(students)
+            groups[-1][1].append(courses)
+            groups[-1] = (groups[-1][0], groups[-1][1], groups[-1][2] + pairCount)
+        groups = [(concatenate(students), concatenate(courses)) for students, courses, pairCount in groups]
+        subMatchers = [self.subMatcher(students, courses) for students, courses in groups]
+        self.components = len(groups)
+        print("Solving %d independent groups of students and courses" % len(groups))
+        
+        #A warm start other than "greedy" is made into assignments of the whole problem, and each
+        #group gets its own, renumbered as (students, courses) of the sub matcher
+        groupOptions = [options]*len(groups)
+        warmStart = options.get("warmStart")
+        if warmStart is not None and not (isinstance(warmStart, str) and warmStart == "greedy"):
+            assigned = flatnonzero(self.warmStartAssignment(warmStart))
+            groupOptions = []
+            for students, courses in groups:
+                studentIndex = zeros(self.S, dtype=int64) - 1
+                studentIndex[students] = arange(len(students))
+                courseIndex = zeros(self.C, dtype=int64) - 1
+                courseIndex[courses] = arange(len(courses))
+                inGroup = assigned[studentIndex[self.pairStudent[assigned]] >= 0]
+                groupOptions.append(dict(options, warmStart = (studentIndex[self.pairStudent[inGroup]], courseIndex[self.pairCourse[inGroup]])))
+        
+        with self.report.phase("solver"):
+            if len(subMatchers) <= 1:
+                results = [solveSubMatcher(subMatcher, solver, backend, subOptions) for subMatcher, subOptions in zip(subMatchers, groupOptions)]
+            else:
+                poolSize = min(workers or availableCpus()[0], len(subMatchers))
+                groupOptions = [self.shareThreads(subOptions, poolSize) for subOptions in groupOptions]
+                with ProcessPoolExecutor(max_workers = poolSize) as pool:
+                    results = list(pool.map(solveSubMatcher, subMatchers, [solver]*len(subMatchers),
+                                            [backend]*len(subMatchers), groupOptions))
+        
+        #Merge the solutions back into the full pair arrays
+        self.pairValues = zeros(len(self.pairStudent), dtype=int8)
+        statuses = []
+        self.objectiveValue = 0
+        self.report.modelSize = {}
+        self.report.solverStats = {"groups": len(groups)}
+        for (students, courses), (status, objectiveValue, pairStudent, pairCourse, pairValues, report) in zip(groups, results):
+            assigned = flatnonzero(pairValues)
+            self.pairValues[self.pairIndex(students[pairStudent[assigned]], courses[pairCourse[assigned]])] = 1
+            statuses.append(status)
+            self.objectiveValue += objectiveValue or 0
+            #Sizes and node counts add up over the groups
+            for totals, counts in ((self.report.modelSize, report.modelSize), (self.report.solverStats, report.solverStats)):
+                for key in ("variables", "constraints", "nonzeros", "nodes", "iterations"):
+                    if isinstance(counts.get(key), int):
+                        totals[key] = totals.get(key, 0) + counts[key]
+        notOptimal = [status for status in statuses if status != "Optimal"]
+        self.status = notOptimal[0] if notOptimal else "Optimal"
+    
+    def solvePulp(self, solver, warmStart = None, rebuild = True, timeLimit = None, gapRel = None, gapAbs = None, **options):
+        if rebuild or self.model is None:
+            self.initProblem()
+        solverOptions = self.pulpSolverOptions(solver, **options)
+        if warmStart is not None:
+            self.setInitialValues(self.warmStartAssignment(warmStart))
+            solverOptions["warmStart"] = True
+        if timeLimit is not None:
+            solverOptions["timeLimit"] = timeLimit
+        if gapRel is not None:
+            solverOptions["gapRel"] = gapRel
+        if gapAbs is not None:
+            solverOptions["gapAbs"] = gapAbs
         #self.model.writeLP("TAS.lp")
-        self.model.solve(getSolver(solver))
-        print("Status:", LpStatus[self.model.status])
-        print("Objective value: ", value(self.model.objective))
+        with self.report.phase("solver") as measured:
+            if solver == "PULP_CBC_CMD":
+                measured["solverPeakMemoryMB"] = self.solveWatchingLog(solverOptions)
+            else:
+                self.model.solve(getSolver(solver, **solverOptions))
+        if not rebuild:
+            self.report.modelSize = self.pulpModelSize()
+        self.status = LpStatus[self.model.status]
+        if self.model.sol_status == LpSolutionIntegerFeasible:
+            self.status = "Feasible"
+        self.objectiveValue = value(self.model.objective)
+        
+        #Solution for each preferred pair (none if the solver didn't find an integer solution)
+        if self.status not in ("Optimal", "Feasible"):
+            self.objectiveValue = None
+            self.pairValues = zeros(len(self.pairStudent), dtype=int8)
+            return
+        self.pairValues = array([self.studentAssignments[s][c].varValue or 0 for s, c
+                                 in zip(self.pairStudent.tolist(), self.pairCourse.tolist())]).round().astype(int8)
     
-    def outputResults(self):
-        #Convert the variables to their values
-        for c in range(self.C):
-            for s in range(self.S):    
-                self.studentAssignments[s][c] = int(self.studentAssignments[s][c].varValue)
-        
-        #Output Results
-        numFirstChoiceAssignment = 0
-        numSecondChoiceAssignment = 0
-        numThirdChoiceAssignment = 0
-        numNoChoiceAssignment = 0
-        numNoAssignment = 0
-        numMultiAssignment = 0
-        self.studentIdAssignments = [[-1] for s in range(self.S)]
-        courseSizes = [0 for c in range(self.C)]
-        courseFirstChoices = [0 for c in range(self.C)]
-        courseSecondChoices = [0 for c in range(self.C)]
-        courseThirdChoices = [0 for c in range(self.C)]
-        for s in range(self.S):
-            firstChoice = self.studentFirstChoices[s]
-            secondChoice = self.studentSecondChoices[s]
-            thirdChoice = self.studentThirdChoices[s]
-            sumAssignments = 0
-            for c in range(self.C):        
-                #Courses Stats
-                courseId = c+1
-                if (courseId == firstChoice): 
-                    courseFirstChoices[c] += 1
-                elif (courseId == secondChoice):
-                    courseSecondChoices[c] += 1
-                elif (courseId == thirdChoice):
-                    courseThirdChoices[c] += 1  
-                if (self.studentAssignments[s][c] == 1): 
-                    courseSizes[c] += 1
-                    
-                #Students Stats
-                if (self.studentAssignments[s][c] == 1): 
-                    if (courseId == firstChoice): 
-                        numFirstChoiceAssignment+=1
-                    elif (courseId == secondChoice):
-                        numSecondChoiceAssignment+=1
-                    elif (courseId == thirdChoice):
-                        numThirdChoiceAssignment+=1
-                    else:
-                        numNoChoiceAssignment+=1
-                    sumAssignments+=1
-                    if self.studentIdAssignments[s][0] == -1:
-                        self.studentIdAssignments[s][0] = courseId
+    def solveWatchingLog(self, solverOptions):
+        #Runs CBC in a thread and reads its log while it's written, echoing it, keeping its statistics
+        #and reporting each incumbent. Returns CBC's peak memory in MB, sampled as it runs
+        handle, logPath = mkstemp(suffix=".log")
+        os.close(handle)
+        errors = []
+        def run():
+            try:
+                self.model.solve(getSolver("PULP_CBC_CMD", msg=False, logPath=logPath, **solverOptions))
+            except Exception as error:
+                errors.append(error)
+        thread = Thread(target=run)
+        thread.start()
+        peak = None
+        lastSample = 0
+        try:
+            with open(logPath) as log:
+                line = ""
+                while True:
+                    running = thread.is_alive()
+                    if perf_counter() - lastSample >= 0.05:
+                        lastSample = perf_counter()
+                        memory = childPeakMemory()
+                        if memory is not None:
+                            peak = memory if peak is None else max(peak, memory)
+                    line += log.readline()
+                    if line.endswith("\n"):
+                        print(line, end="")
+                        self.readCbcLine(line)
+                        line = ""
+                    elif not running:
+                        print(line, end="")
+                        break
                     else:
-                        self.studentIdAssignments[s].append(courseId)
-            if sumAssignments > 1:
-                numMultiAssignment+=1
-            elif sumAssignments == 0:
-                numNoAssignment+=1
-                
-        #Print some stats            
-        prefobj = 5*numFirstChoiceAssignment+3*numSecondChoiceAssignment+numThirdChoiceAssignment
-        print('Placement Objective Value: %d' % prefobj)
-        print('First Choice Assignments: %.5f (%d/%d)' 
-              % (float(numFirstChoiceAssignment)/self.S, numFirstChoiceAssignment, self.S))
-        print('Second Choice Assignments: %.5f (%d/%d)' 
-              % (float(numSecondChoiceAssignment)/self.S, numSecondChoiceAssignment, self.S))
-        print('Third Choice Assignments: %.5f (%d/%d)'
-              % (float(numThirdChoiceAssignment)/self.S, numThirdChoiceAssignment, self.S))
-        print('No Choice Assignments: %.5f (%d/%d)'
-              % (float(numNoChoiceAssignment)/self.S, numNoChoiceAssignment, self.S))
-        print('Multi Assignments: %.5f (%d/%d)'
-              % (float(numMultiAssignment)/self.S, numMultiAssignment, self.S))
-        print('No Assignments: %.5f (%d/%d)'
-              % (float(numNoAssignment)/self.S, numNoAssignment, self.S))
-        
-        
-        #Output to CSV
-        with open('Output_Courses.csv', mode='w', encoding='utf-8') as course_file:
-            course_writter = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator = '\n')
-            #write column names
-            columnNames = []
-            columnNames.append('Course number')
-            columnNames.append('Course name')
-            columnNames.append('First choice')
-            columnNames.append('Second choice')
-            columnNames.append('Third choice')
-            columnNames.append('Weight')
-            columnNames.append('Minimum class size')
-            columnNames.append('Maximum class size')
-            columnNames.append('Students assigned')
-            course_writter.writerow(columnNames)
+                        sleep(0.05)
+        finally:
+            thread.join()
+            os.remove(logPath)
+        if errors:
+            raise errors[0]
+        return peak
+    
+    def readCbcLine(self, line):
+        #CBC minimizes -objective for a maximization, except for the continuous objective line
+        number = r"([-+]?[\d.]+(?:e[-+]?\d+)?)"
+        stats = self.report.solverStats
+        match = re.search(r"Continuous objective value is " + number, line)
+        if match:
+            self.bestBound = stats["lpBound"] = float(match.group(1))
+        match = re.search(r"At root node, (\d+) cuts changed objective from \S+ to " + number, line)
+        if match:
+            stats["cuts"] = int(match.group(1))
+            stats["rootBound"] = self.model.sense*float(match.group(2))
+        for key, pattern in (("nodes", r"Enumerated nodes:\s+(\d+)"), ("iterations", r"Total iterations:\s+(\d+)")):
+            match = re.search(pattern, line)
+            if match:
+                stats[key] = int(match.group(1))
+        match = re.search(r"Time \(Wallclock seconds\):\s+" + number, line)
+        if match:
+            stats["cbcSeconds"] = float(match.group(1))
+        match = re.search(r"Result - (.*)", line)
+        if match:
+            stats["result"] = match.group(1).strip()
+        match = re.search(r"(?:best possible|changed objective from \S+ to|Search completed - best objective) " + number, line)
+        if match:
+            self.bestBound = self.model.sense*float(match.group(1))
+        match = re.search(r"(?:Integer solution of|solution with cost) " + number, line)
+        if match:
+            objective = self.model.sense*float(match.group(1))
+            if len(self.incumbents) == 0 or objective > self.incumbents[-1].objective:
+                self.reportIncumbent(objective)
+    
+    def solveScipy(self, solver, warmStart = None, timeLimit = None, gapRel = None, gapAbs = None, **options):
+        #scipy's milp can't take a starting solution, an absolute gap or a number of threads, so those are ignored here
+        self.initMatrixProblem()
+        scipyOptions = {}
+        if options.get("solverPresolve") is not None:
+            scipyOptions["presolve"] = options["solverPresolve"]
+        if timeLimit is not None:
+            scipyOptions["time_limit"] = timeLimit
+        if gapRel is not None:
+            scipyOptions["mip_rel_gap"] = gapRel
+        with self.report.phase("solver"):
+            self.status, self.objectiveValue, x = self.matrix.solveScipy(scipyOptions)
+        self.bestBound = self.matrix.bestBound
+        self.report.solverStats = self.matrix.solverStats
+        self.setMatrixSolution(x)
+    
+    def solveHighs(self, solver, warmStart = None, timeLimit = None, gapRel = None, gapAbs = None, **options):
+        #HiGHS in process from the MatrixModel arrays, with its better solutions reported as they're found
+        self.initMatrixProblem()
+        start = None
+        if warmStart is not None:
+            start = self.matrixStart(self.warmStartAssignment(warmStart))
+        def onImprovement(objective, bound):
+            self.bestBound = bound if isfinite(bound) else None
+            if len(self.incumbents) == 0 or objective > self.incumbents[-1].objective:
+                self.reportIncumbent(objective)
+        with self.report.phase("solver"):
+            self.status, self.objectiveValue, x = self.matrix.solveHighs(timeLimit, gapRel, gapAbs, start, onImprovement,
+                                                                         threads = options.get("threads"), presolve = options.get("solverPresolve"))
+        self.bestBound = self.matrix.bestBound
+        self.report.solverStats = self.matrix.solverStats
+        self.setMatrixSolution(x)
+    
+    def matrixStart(self, pairValues):
+        #(columns, values) of a starting solution in the MatrixModel, that the solver completes
+        return self.pairColumns, asarray(pairValues, dtype=float64)
+    
+    def solveOrtools(self, solver, warmStart = None, timeLimit = None, gapRel = None, gapAbs = None, ortoolsSolver = "SCIP", **options):
+        self.initMatrixProblem()
+        with self.report.phase("solver"):
+            self.status, self.objectiveValue, x = self.matrix.solveOrtools(ortoolsSolver, timeLimit, gapRel, gapAbs, options.get("threads"),
+                                                                           options.get("solverPresolve"), options.get("cuts"))
+        self.bestBound = self.matrix.bestBound
+        self.report.solverStats = self.matrix.solverStats
+        self.setMatrixSolution(x)
+    
+    def solveRelaxAndRound(self, solver, backend, timeLimit = None, **options):
+        #LP relaxation, then the choices it gives more than half of, made feasible by greedyAssignment
+        with self.report.phase("solver"):
+            lpStatus, lpBound, pairLp = getattr(self, self.relaxationBackends[backend])(solver, timeLimit, **options)
+        if lpStatus != "Optimal":
+            self.status, self.objectiveValue = lpStatus, None
+            self.pairValues = zeros(len(self.pairStudent), dtype=int8)
+            return
+        with self.report.phase("rounding"):
+            self.pairValues = self.repairAssignment((pairLp > 0.5).astype(int8))
+        self.objectiveValue = self.assignmentValue(self.pairValues)
+        self.bestBound = lpBound
+        self.status = "Optimal" if self.objectiveValue >= lpBound - 1e-6 else "Feasible"
+        self.report.solverStats = {"lpBound": lpBound, "roundedObjective": self.objectiveValue,
+                                   "gap": relativeGap(self.objectiveValue, lpBound)}
+        print("LP bound: %.2f, rounded solution: %s, gap to the bound: %.2f%%"
+              % (lpBound, self.objectiveValue, 100*relativeGap(self.objectiveValue, lpBound)))
+    
+    def repairAssignment(self, pairValues):
+        #A feasible assignment close to pairValues, made by each type of Matcher
+        return self.greedyAssignment(pairValues)
+    
+    def assignmentValue(self, pairValues):
+        #Objective of a feasible assignment, its placement value
+        return int(self.pairWeight[asarray(pairValues) > 0].astype(int64).sum())
+    
+    def relaxPulp(self, solver, timeLimit = None, **options):
+        #The PuLP model solved as an LP, as (status, objective, value of each preferred pair)
+        self.initProblem()
+        solverOptions = dict(self.pulpSolverOptions(solver, **options), mip = False, msg = False)
+        if timeLimit is not None:
+            solverOptions["timeLimit"] = timeLimit
+        self.model.solve(getSolver(solver, **solverOptions))
+        pairLp = array([self.studentAssignments[s][c].varValue or 0 for s, c
+                        in zip(self.pairStudent.tolist(), self.pairCourse.tolist())], dtype=float64)
+        return LpStatus[self.model.status], value(self.model.objective), pairLp
+    
+    def relaxScipy(self, solver, timeLimit = None, solverPresolve = None, **options):
+        self.initMatrixProblem()
+        scipyOptions = {} if timeLimit is None else {"time_limit": timeLimit}
+        if solverPresolve is not None:
+            scipyOptions["presolve"] = solverPresolve
+        status, lpBound, x = self.matrix.solveScipy(scipyOptions, relax = True)
+        return status, lpBound, None if x is None else x[self.pairColumns]
+    
+    def solveHeuristic(self, solver, timeLimit = None, warmStart = None, **options):
+        #Greedy assignment (or the warm start), improved by LocalSearch until nothing improves or timeLimit runs out.
+        #The course bounds stay hard, also for a SoftConstraintMatcher
+        self.makePreferences()
+        deadline = None if timeLimit is None else self.solveStart + timeLimit
+        with self.report.phase("solver"):
+            self.bestBound = self.choiceBound()
+            start = self.greedyAssignment() if warmStart is None else self.warmStartAssignment(warmStart)
+            greedyObjective = self.assignmentValue(start)
+            self.reportIncumbent(greedyObjective)
+            search = LocalSearch(self.pairStudent, self.pairCourse, self.pairWeight, self.courseMins, self.courseMaxs, self.S, start)
+            search.run(deadline, lambda: self.reportIncumbent(self.assignmentValue(search.pairValues())))
+        self.pairValues = search.pairValues()
+        self.objectiveValue = self.assignmentValue(self.pairValues)
+        self.status = "Optimal" if self.objectiveValue >= self.bestBound else "Feasible"
+        self.report.solverStats = {"greedyObjective": greedyObjective, "moves": search.moves, "bestBound": self.bestBound}
+        print("Heuristic: greedy %d, %d after %d local search moves, at most %d if every student got their best choice"
+              % (greedyObjective, self.objectiveValue, search.moves, self.bestBound))
+    
+    def choiceBound(self):
+        #Placement value if every student got their best choice
+        best = zeros(self.S, dtype=int64)
+        maximum.at(best, self.pairStudent, self.pairWeight)
+        return int(best.sum())
+    
+    def relaxHighs(self, solver, timeLimit = None, threads = None, solverPresolve = None, **options):
+        self.initMatrixProblem()
+        status, lpBound, x = self.matrix.solveHighs(timeLimit, relax = True, threads = threads, presolve = solverPresolve)
+        return status, lpBound, None if x is None else x[self.pairColumns]
+    
+    def setMatrixSolution(self, x):
+        #Solution for each preferred pair
+        self.pairValues = zeros(len(self.pairColumns), dtype=int8) if x is None else rint(x[self.pairColumns]).astype(int8)
+    
+    def solvePortfolio(self, solver, portfolio = None, timeLimit = None, **options):
+        self.makePreferences()
+        if portfolio is None:
+            portfolio = [backend for backend, package in self.portfolioBackends.items() if find_spec(package) is not None]
+        
+        #Every process gets a copy of the input data and builds its own model
+        subMatcher = self.subMatcher(arange(self.S), arange(self.C))
+        options = self.shareThreads(dict(options, timeLimit = timeLimit), len(portfolio))
+        results = Queue()
+        processes = [Process(target=raceSubMatcher, args=(subMatcher, solver, backend, options, results))
+                     for backend in portfolio]
+        with self.report.phase("solver"):
+            for process in processes:
+                process.start()
             
-            #write row data
-            for c in range(self.C):
-                rowData = []
-                c1 = courseFirstChoices[c]
-                c2 = courseSecondChoices[c]
-                c3 = courseThirdChoices[c]
-                
-                rowData.append(c+1) #'Course number'
-                rowData.append(self.courseNames[c]) #'Course name'
-                rowData.append(c1) #'First choice'
-                rowData.append(c2) #'Second choice'
-                rowData.append(c3) #'Third choice'
-                rowData.append(5*c1+3*c2+c3) #'Weight'
-                rowData.append(self.courseMins[c]) #'Minimum class size'
-                rowData.append(self.courseMaxs[c]) #'Maximum class size'
-                rowData.append(courseSizes[c]) #'Students assigned'
-                course_writter.writerow(rowData)
-        
-        with open('Output_Assigned_Students.csv', mode='w', encoding='utf-8') as course_file:
-            student_writer = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator = '\n')
-            #write column names
-            columnNames = []
-            columnNames.append('Student ID')
-            columnNames.append('First Name')
-            columnNames.append('Last Name')
-            columnNames.append('Course Assignment')
-            student_writer.writerow(columnNames)
+            #Wait for a proven optimum, or for every solver to stop
+            best = None
+            finished = 0
+            while finished < len(processes):
+                try:
+                    result = results.get(timeout = 1)
+                except Empty:
+                    if not any(process.is_alive() for process in processes) and results.empty():
+                        break
+                    continue
+                finished += 1
+                backend, status, objectiveValue = result[:3]
+                print("Portfolio: %s finished with status %s, objective %s" % (backend, status, objectiveValue))
+                if status in ("Optimal", "Feasible") and (best is None or objectiveValue > best[2]):
+                    best = result
+                    if status == "Optimal":
+                        self.bestBound = objectiveValue
+                    self.reportIncumbent(objectiveValue)
+                if status == "Optimal":
+                    break
+            for process in processes:
+                stopProcess(process)
+        
+        if best is None:
+            self.portfolioWinner = None
+            self.status = "Not Solved"
+            self.objectiveValue = None
+            self.pairValues = zeros(len(self.pairStudent), dtype=int8)
+        else:
+            self.portfolioWinner, self.status, self.objectiveValue, pairStudent, pairCourse, self.pairValues, report = best
+            self.report.modelSize = report.modelSize
+            self.report.solverStats = dict(report.solverStats, backend = self.portfolioWinner)
+        print("Portfolio winner:", self.portfolioWinner)
+    
+    def pairIndex(self, students, courses):
+        #Index of each (student, course) in the pair arrays, -1 if it isn't one of the student's choices
+        students = asarray(students, dtype=int64)
+        courses = asarray(courses, dtype=int64)
+        keys = self.pairStudent.astype(int64)*self.C + self.pairCourse
+        order = argsort(keys, kind="stable")
+        wanted = students*self.C + courses
+        positions = searchsorted(keys[order], wanted).clip(0, max(len(order) - 1, 0))
+        found = (students >= 0) & (students < self.S) & (courses >= 0) & (courses < self.C)
+        if len(order) == 0:
+            return zeros(len(wanted), dtype=int64) - 1
+        found &= keys[order][positions] == wanted
+        return where(found, order[positions], -1)
+    
+    def firstPairsInEachCourse(self, pairs, room):
+        #The first room[c] of the given pairs for each course c, keeping their order
+        ordered = pairs[argsort(self.pairCourse[pairs], kind="stable")]
+        courses = self.pairCourse[ordered]
+        position = arange(len(ordered)) - searchsorted(courses, courses)
+        return ordered[position < room[courses]]
+    
+    def greedyAssignment(self, pairValues = None, closeShortCourses = True):
+        #Gives each unassigned student their highest choice that still has room, then closes the
+        #course furthest below its min and tries again, until every course that runs is within bounds.
+        #Starts from pairValues if given, after dropping second assignments and students over a max.
+        #closeShortCourses = False stops after the first pass, leaving courses below their min.
+        courseMins = asarray(self.courseMins, dtype=int64)
+        courseMaxs = asarray(self.courseMaxs, dtype=int64).clip(0)
+        assigned = zeros(len(self.pairStudent), dtype=int8)
+        if pairValues is not None:
+            pairs = flatnonzero(asarray(pairValues))
+            pairs = pairs[unique(self.pairStudent[pairs], return_index=True)[1]]
+            assigned[self.firstPairsInEachCourse(pairs, courseMaxs)] = 1
+        
+        isOpen = ones(self.C, dtype=bool)
+        while True:
+            for rank in range(len(self.preferenceWeights)):
+                courseSizes = bincount(self.pairCourse, weights=assigned, minlength=self.C).astype(int64)
+                room = where(isOpen, courseMaxs - courseSizes, 0)
+                isAssigned = bincount(self.pairStudent, weights=assigned, minlength=self.S) > 0
+                candidates = flatnonzero((self.pairRank == rank) & ~isAssigned[self.pairStudent])
+                assigned[self.firstPairsInEachCourse(candidates, room)] = 1
             
-            #write row data
+            courseSizes = bincount(self.pairCourse, weights=assigned, minlength=self.C)
+            shortCourses = flatnonzero(isOpen & (courseSizes > 0) & (courseSizes < courseMins))
+            if len(shortCourses) == 0 or not closeShortCourses:
+                return assigned
+            c = shortCourses[argmin(courseSizes[shortCourses] / courseMins[shortCourses])]
+            isOpen[c] = False
+            assigned[self.pairCourse == c] = 0
+    
+    def readAssignments(self, fileLocation):
+        #Pair values from a previous Output_Assigned_Students.csv (first course of each student)
+        previous = read_csv(fileLocation)
+        students = previous["Student ID"].to_numpy(dtype=int64) - 1
+        courses = previous["Course Assignment"].astype(str).str.split(",").str[0].astype(int64).to_numpy() - 1
+        return self.assignmentPairValues(students, courses)
+    
+    def assignmentPairValues(self, students, courses):
+        #Pair values of the assignments of students (indexes) to courses (indexes), skipping any that aren't preferred pairs
+        pairs = self.pairIndex(students, courses)
+        pairValues = zeros(len(self.pairStudent), dtype=int8)
+        pairValues[pairs[pairs >= 0]] = 1
+        return pairValues
+    
+    def warmStartAssignment(self, warmStart):
+        #warmStart is "greedy", a previous Output_Assigned_Students.csv, pair values, or a tuple
+        #(students, courses) of the indexes of assignments
+        if isinstance(warmStart, str) and warmStart == "greedy":
+            return self.greedyAssignment()
+        if isinstance(warmStart, str):
+            return self.greedyAssignment(self.readAssignments(warmStart))
+        if isinstance(warmStart, tuple):
+            return self.greedyAssignment(self.assignmentPairValues(*warmStart))
+        return self.greedyAssignment(warmStart)
+    
+    def setInitialValues(self, pairValues):
+        if not self.sparse:
             for s in range(self.S):
-                ca = "%d"%self.studentIdAssignments[s][0]
-                for i in range(1, len(self.studentIdAssignments[s])):
-                    ca += ", %d"%self.studentIdAssignments[s][i]
-                
-                rowData = []
-                rowData.append(s+1)#'Student ID'
-                rowData.append(self.studentFirstName[s])#'First Name'
-                rowData.append(self.studentLastName[s])#'Last Name'
-                rowData.append(ca)#'Course Assignment'
-                student_writer.writerow(rowData)
-
-                
-        with open('Output_Unassigned_Students.csv', mode='w', encoding='utf-8') as course_file:
-            student_writer = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator = '\n')
-            #write column names
-            columnNames = []
-            columnNames.append('Student ID')
-            columnNames.append('First Name')
-            columnNames.append('Last Name')
-            student_writer.writerow(columnNames)
+                for c in range(self.C):
+                    self.studentAssignments[s][c].setInitialValue(0)
+        for s, c, assigned in zip(self.pairStudent.tolist(), self.pairCourse.tolist(), asarray(pairValues).tolist()):
+            self.studentAssignments[s][c].setInitialValue(assigned)
+    
+    ##### Changes to a solved model, followed by resolve() #####
+    def studentWeights(self, s):
+        #{course index: weight} of student s (pairs are ordered by student)
+        start, end = searchsorted(self.pairStudent, [s, s + 1])
+        return dict(zip(self.pairCourse[start:end].tolist(), self.pairWeight[start:end].tolist()))
+    
+    def canEditModel(self):
+        #Only a sparse PuLP model is changed in place, a dense, strengthened or presolved one is rebuilt by the next solve
+        if not self.sparse or self.strengthen or self.presolve:
+            self.model = None
+        return self.model is not None
+    
+    def keepSolution(self):
+        #Assigned (student, course) pairs of the last solution, to carry it over a change
+        if self.pairValues is None:
+            return None
+        assigned = flatnonzero(self.pairValues)
+        return self.pairStudent[assigned], self.pairCourse[assigned]
+    
+    def restoreSolution(self, kept):
+        if kept is None:
+            return
+        pairs = self.pairIndex(*kept)
+        self.pairValues = zeros(len(self.pairStudent), dtype=int8)
+        self.pairValues[pairs[pairs >= 0]] = 1
+    
+    def addPair(self, s, c, weight):
+        #A variable that was removed before is reused, its name is still taken in the model
+        if c not in self.studentAssignments[s]:
+            self.studentAssignments[s][c] = LpVariable("S%dC%d"%(s,c), 0, 1, LpInteger)
+        variable = self.studentAssignments[s][c]
+        variable.upBound = 1
+        self.model.objective.addInPlace(weight*variable)
+        self.sumStudentsInClass[c].addInPlace(variable)
+        self.courseStudents[c].append(s)
+    
+    def removePair(self, s, c, weight):
+        variable = self.studentAssignments[s][c]
+        variable.upBound = 0
+        variable.setInitialValue(0)
+        self.model.objective.addInPlace(-weight*variable)
+        self.sumStudentsInClass[c].addInPlace(-variable)
+        self.courseStudents[c].remove(s)
+    
+    def editStudent(self, s, oldWeights, newWeights):
+        for c in oldWeights.keys() - newWeights.keys():
+            self.removePair(s, c, oldWeights[c])
+        for c in newWeights.keys() - oldWeights.keys():
+            self.addPair(s, c, newWeights[c])
+        for c in oldWeights.keys() & newWeights.keys():
+            if oldWeights[c] != newWeights[c]:
+                self.model.objective.addInPlace((newWeights[c] - oldWeights[c])*self.studentAssignments[s][c])
+        self.studentCourses[s] = list(newWeights)
+    
+    def addStudentRows(self, s):
+        #Constraints of a new student, made by each type of Matcher
+        pass
+    
+    def editCourseBounds(self, c, oldMin, oldMax):
+        #Constraints that use the course bounds, changed by each type of Matcher
+        pass
+    
+    def updateStudent(self, s, firstChoice, secondChoice, thirdChoice):
+        #Changes the three choices (course numbers, 0 for none) of student s
+        kept = self.keepSolution()
+        #The model (and so the pair arrays) may not have been built yet
+        editModel = self.canEditModel()
+        oldWeights = self.studentWeights(s) if editModel else None
+        self.studentChoices[s] = [firstChoice, secondChoice, thirdChoice]
+        self.makePreferences()
+        self.restoreSolution(kept)
+        if editModel:
+            self.editStudent(s, oldWeights, self.studentWeights(s))
+    
+    def addStudent(self, firstName, lastName, firstChoice, secondChoice, thirdChoice):
+        #Adds a student after the others and returns their index
+        kept = self.keepSolution()
+        s = self.S
+        self.studentFirstName = append(self.studentFirstName, firstName)
+        self.studentLastName = append(self.studentLastName, lastName)
+        self.studentChoices = vstack([self.studentChoices, array([[firstChoice, secondChoice, thirdChoice]], dtype=int32)])
+        self.S += 1
+        self.makePreferences()
+        self.restoreSolution(kept)
+        if self.canEditModel():
+            self.studentAssignments.append({})
+            self.studentCourses.append([])
+            self.addStudentRows(s)
+            self.editStudent(s, {}, self.studentWeights(s))
+        return s
+    
+    def updateCourseBounds(self, c, courseMin = None, courseMax = None):
+        #Changes the min and/or max size of course c
+        oldMin, oldMax = self.courseMins[c], self.courseMaxs[c]
+        if courseMin is not None:
+            self.courseMins[c] = courseMin
+        if courseMax is not None:
+            self.courseMaxs[c] = courseMax
+        if self.canEditModel():
+            self.editCourseBounds(c, oldMin, oldMax)
+    
+    def removeCourse(self, c):
+        #Closes course c so nobody can be assigned to it. It keeps its number and its row in the outputs
+        self.updateCourseBounds(c, 0, 0)
+        if self.canEditModel():
+            for s in self.courseStudents[c]:
+                self.studentAssignments[s][c].upBound = 0
+    
+    def resolve(self, solver = "PULP_CBC_CMD", **options):
+        #Solves the changed model without rebuilding it, starting from the last solution
+        if self.pairValues is not None:
+            options.setdefault("warmStart", self.pairValues)
+        self.solve(solver, "pulp", rebuild = False, **options)
+    
+    def results(self):
+        #The solution as tables, counted with array operations over the assigned pairs
+        assigned = flatnonzero(self.pairValues)
+        students = self.pairStudent[assigned]
+        courses = self.pairCourse[assigned]
+        courseSizes = bincount(courses, minlength=self.C)
+        sumAssignments = bincount(students, minlength=self.S)
+        rankCounts = bincount(self.pairRank[assigned], minlength=len(self.preferenceWeights))
+        
+        #Courses Stats
+        courseChoices = [bincount(choices[choices >= 0], minlength=self.C) for choices in self.studentChoiceIndex.T]
+        courseWeights = sum(weight*choices for weight, choices in zip(self.preferenceWeights, courseChoices))
+        courseTable = DataFrame({
+            'Course number': arange(1, self.C + 1),
+            'Course name': self.courseNames,
+            'First choice': courseChoices[0],
+            'Second choice': courseChoices[1],
+            'Third choice': courseChoices[2],
+            'Weight': courseWeights,
+            'Minimum class size': self.courseMins,
+            'Maximum class size': self.courseMaxs,
+            'Students assigned': courseSizes})
+        
+        #Course numbers of each student ("-1" if none), the assigned pairs are ordered by student
+        courseAssignment = full(self.S, "-1", dtype=object)
+        courseAssignment[students] = (courses + 1).astype(str)
+        multiStudents = flatnonzero(sumAssignments > 1)
+        starts = searchsorted(students, multiStudents)
+        ends = searchsorted(students, multiStudents, side="right")
+        for s, start, end in zip(multiStudents.tolist(), starts.tolist(), ends.tolist()):
+            courseAssignment[s] = ", ".join((courses[start:end] + 1).astype(str))
+        studentTable = DataFrame({
+            'Student ID': arange(1, self.S + 1),
+            'First Name': self.studentFirstName,
+            'Last Name': self.studentLastName,
+            'Course Assignment': courseAssignment})
+        unassignedTable = studentTable.loc[sumAssignments == 0, ['Student ID', 'First Name', 'Last Name']]
+        
+        stats = {'First Choice Assignments': int(rankCounts[0]),
+                 'Second Choice Assignments': int(rankCounts[1]),
+                 'Third Choice Assignments': int(rankCounts[2]),
+                 'No Choice Assignments': int(rankCounts[3:].sum()),
+                 'Multi Assignments': int((sumAssignments > 1).sum()),
+                 'No Assignments': int((sumAssignments == 0).sum())}
+        placementValue = int((asarray(self.preferenceWeights)[:3]*rankCounts[:3]).sum())
+        return MatchResults(courseTable, studentTable, unassignedTable, stats, placementValue, self.S)
+    
+    def outputResults(self, outputDirectory = ".", fileFormat = "csv", streams = None):
+        #Writes the four outputs to outputDirectory, or only to the streams if they're given (see MatchResults)
+        with self.report.phase("output"):
+            results = self.results()
             
-            #write row data
-            for s in range(self.S):
-                if (self.studentIdAssignments[s][0] == -1):            
-                    rowData = []
-                    rowData.append(s+1)#'Student ID'
-                    rowData.append(self.studentFirstName[s])#'First Name'
-                    rowData.append(self.studentLastName[s])#'Last Name'
-                    student_writer.writerow(rowData)
-                    
-        with open('Output_Stats.csv', mode='w', encoding='utf-8') as course_file:
-            stats_writer = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator = '\n')
-            #write column names
-            stats_writer.writerow(['First Choice Assignments: %.5f (%d/%d)' 
-                  % (float(numFirstChoiceAssignment)/self.S, numFirstChoiceAssignment, self.S)])
-            stats_writer.writerow(['Second Choice Assignments: %.5f (%d/%d)' 
-                  % (float(numSecondChoiceAssignment)/self.S, numSecondChoiceAssignment, self.S)])
-            stats_writer.writerow(['Third Choice Assignments: %.5f (%d/%d)'
-                  % (float(numThirdChoiceAssignment)/self.S, numThirdChoiceAssignment, self.S)])
-            stats_writer.writerow(['No Choice Assignments: %.5f (%d/%d)'
-                  % (float(numNoChoiceAssignment)/self.S, numNoChoiceAssignment, self.S)])
-            stats_writer.writerow(['Multi Assignments: %.5f (%d/%d)'
-                  % (float(numMultiAssignment)/self.S, numMultiAssignment, self.S)])
-            stats_writer.writerow(['No Assignments: %.5f (%d/%d)'
-                  % (float(numNoAssignment)/self.S, numNoAssignment, self.S)])
+            #Print some stats
+            print('Placement Objective Value: %d' % results.placementValue)
+            for line in results.statLines():
+                print(line)
+            
+            results.write(outputDirectory, fileFormat, streams)
+        return results
 
 class HardConstraintMatcher(Matcher):
+    """
+    Every course that runs (classWillRun) is between its min and max size, and each student is
+    assigned to at most one of their choices.
+    
+    With strengthen = True the model has a tighter LP relaxation, so CBC needs fewer nodes:
+        -x[s][c] <= classWillRun[c] for each preferred pair (the disaggregated linking cuts)
+        -classWillRun[c] = 0 for a course that fewer students chose than its min
+        -the max row of a course uses min(max, students who chose it) as its big-M
+        -students with the same choices are interchangeable, so the earlier one is given an
+         assignment at least as good as the later one (symmetry breaking)
+    A strengthened model is rebuilt instead of edited in place by resolve().
+    
+    With presolve = True the courses that can't reach their min have classWillRun = 0, the max
+    rows use the same big-M as above, and a course with no min that can't go over its max always
+    runs (classWillRun = 1).
+    """
+    
+    modelAttributes = Matcher.modelAttributes + ("classWillRun", "classConstraints", "maxAssignmentConstraint")
+    
     def initVariables(self):
         super(HardConstraintMatcher, self).initVariables()
-        self.classWillRun = [LpVariable("C%dr"%c, 0, 1, LpInteger) 
-                       for c in range(self.C)]
+        runLower, runUpper = self.courseRunBounds()
+        self.classWillRun = [LpVariable("C%dr"%c, lower, upper, LpInteger) 
+                       for c, lower, upper in zip(range(self.C), runLower.tolist(), runUpper.tolist())]
+    
+    def setInitialValues(self, pairValues):
+        super(HardConstraintMatcher, self).setInitialValues(pairValues)
+        courseSizes = bincount(self.pairCourse, weights=pairValues, minlength=self.C)
+        for c in range(self.C):
+            self.classWillRun[c].setInitialValue(max(int(courseSizes[c] > 0), int(self.classWillRun[c].lowBound)))
+    
+    def addPair(self, s, c, weight):
+        super(HardConstraintMatcher, self).addPair(s, c, weight)
+        variable = self.studentAssignments[s][c]
+        self.maxAssignmentConstraint[s].addInPlace(variable)
+        self.classConstraints[0][c].addInPlace(variable)
+        self.classConstraints[1][c].addInPlace(variable)
+    
+    def removePair(self, s, c, weight):
+        super(HardConstraintMatcher, self).removePair(s, c, weight)
+        variable = self.studentAssignments[s][c]
+        self.maxAssignmentConstraint[s].addInPlace(-variable)
+        self.classConstraints[0][c].addInPlace(-variable)
+        self.classConstraints[1][c].addInPlace(-variable)
+    
+    def addStudentRows(self, s):
+        maxAssignmentConstraint = LpConstraint(e=LpAffineExpression(), sense=-1, name="S%dM"%s, rhs=1)
+        self.maxAssignmentConstraint.append(maxAssignmentConstraint)
+        self.model += maxAssignmentConstraint
+    
+    def editCourseBounds(self, c, oldMin, oldMax):
+        #hardMin = sum - min*run and hardMax = sum - max*run
+        self.classConstraints[0][c].addInPlace((oldMin - self.courseMins[c])*self.classWillRun[c])
+        self.classConstraints[1][c].addInPlace((oldMax - self.courseMaxs[c])*self.classWillRun[c])
+    
+    def removeCourse(self, c):
+        super(HardConstraintMatcher, self).removeCourse(c)
+        if self.model is not None:
+            self.classWillRun[c].upBound = 0
+    
+    def coursesThatCantRun(self):
+        #Courses that fewer students chose than their min
+        return flatnonzero(self.courseDemand() < asarray(self.courseMins))
+    
+    def courseRunBounds(self):
+        #Bounds of classWillRun: 0 for the courses that can't run, and 1 for the courses that are
+        #always within their bounds (presolve)
+        runLower, runUpper = zeros(self.C), ones(self.C)
+        if self.strengthen or self.presolve:
+            runUpper[self.coursesThatCantRun()] = 0
+        if self.presolve:
+            runLower[(asarray(self.courseMins) <= 0) & (self.courseDemand() <= asarray(self.courseMaxs)) & (runUpper > 0)] = 1
+        return runLower, runUpper
+    
+    def courseCapacities(self):
+        #Big-M of the max rows: the max, or fewer if fewer students chose the course
+        if self.strengthen or self.presolve:
+            return minimum(asarray(self.courseMaxs), self.courseDemand())
+        return asarray(self.courseMaxs)
+    
+    def symmetryRows(self):
+        #Rows sum(x[s][first k choices]) - sum(x[t][first k choices]) >= 0 for consecutive students s, t
+        #with the same choices, as (number of rows, row of each entry, pair of each entry, coefficient)
+        #Each choice's pair, from the pair arrays since presolve may have dropped some choices
+        choices = self.studentChoiceIndex
+        pairOf = zeros(choices.shape, dtype=int64) - 1
+        pairOf[self.pairStudent, self.pairRank] = arange(len(self.pairStudent))
+        valid = pairOf >= 0
+        choices = where(valid, choices, -1)
+        order = lexsort(choices.T[::-1])
+        same = (choices[order[1:]] == choices[order[:-1]]).all(axis=1) & valid[order[1:]].any(axis=1)
+        first, second = order[:-1][same], order[1:][same]
+        
+        rowIds, pairs, coefficients = [], [], []
+        numRows = 0
+        for k in range(choices.shape[1]):
+            withChoice = flatnonzero(valid[first, k])
+            rows = numRows + arange(len(withChoice))
+            for r in range(k + 1):
+                hasRank = valid[first[withChoice], r]
+                for students, coefficient in ((first, 1), (second, -1)):
+                    rowIds.append(rows[hasRank])
+                    pairs.append(pairOf[students[withChoice][hasRank], r])
+                    coefficients.append(zeros(hasRank.sum()) + coefficient)
+            numRows += len(withChoice)
+        if numRows == 0:
+            return 0, zeros(0, dtype=int64), zeros(0, dtype=int64), zeros(0)
+        return numRows, concatenate(rowIds), concatenate(pairs), concatenate(coefficients)
+    
+    def makeMatrixModel(self):
+        super(HardConstraintMatcher, self).makeMatrixModel()
+        P = len(self.pairColumns)
+        courses = arange(self.C)
+        runLower, runUpper = self.courseRunBounds()
+        self.classWillRunColumns = self.matrix.addColumns(zeros(self.C), lower=runLower, upper=runUpper)
+        
+        #Each student is assigned to at most one class
+        self.matrix.addRows(self.S, self.pairStudent, self.pairColumns, 1, upper=1)
+        
+        #Each class that runs is between its min and max size: sum(x) - min*run >= 0 and sum(x) - max*run <= 0
+        rows = concatenate([self.pairCourse, courses])
+        columns = concatenate([self.pairColumns, self.classWillRunColumns])
+        self.minRows = self.matrix.addRows(self.C, rows, columns, concatenate([ones(P), -asarray(self.courseMins)]), lower=0)
+        self.maxRows = self.matrix.addRows(self.C, rows, columns, concatenate([ones(P), -self.courseCapacities()]), upper=0)
+        
+        if self.strengthen:
+            #x[s][c] - run[c] <= 0 for each preferred pair, and the symmetry breaking rows
+            pairs = arange(P)
+            self.matrix.addRows(P, concatenate([pairs, pairs]), concatenate([self.pairColumns, self.classWillRunColumns[self.pairCourse]]),
+                                concatenate([ones(P), -ones(P)]), upper=0)
+            numRows, rowIds, symmetryPairs, coefficients = self.symmetryRows()
+            self.matrix.addRows(numRows, rowIds, self.pairColumns[symmetryPairs], coefficients, lower=0)
+    
+    def matrixStart(self, pairValues):
+        columns, values = super(HardConstraintMatcher, self).matrixStart(pairValues)
+        courseSizes = bincount(self.pairCourse, weights=pairValues, minlength=self.C)
+        return concatenate([columns, self.classWillRunColumns]), concatenate([values, (courseSizes > 0).astype(float64)])
     
     def makeObjective(self):
         super(HardConstraintMatcher, self).makeObjective()
-        objective = LpAffineExpression()
-        for c in range(self.C):
-            for s in range(self.S):
-                objective += self.studentPreferences[s][c]*self.studentAssignments[s][c]
-            #objective += (5*self.S/self.C)*self.classWillRun[c]
+        #self.objective += lpSum((5*self.S/self.C)*self.classWillRun[c] for c in range(self.C))
             
         #Add objective to model
-        self.model += objective
+        self.model += self.objective
     
     def makeConstraints(self):
         super(HardConstraintMatcher, self).makeConstraints()
@@ -362,44 +2090,352 @@ class HardConstraintMatcher(Matcher):
         #     sizeConstraints[c] = LpConstraint(e=constraint, sense=-1, name="C%ds"%c, rhs=0)
         
         #Constraints for each class
-        classConstraints = [[LpConstraint() for c in range(self.C)] for i in range(2)]
+        courseCapacities = self.courseCapacities()
+        self.classConstraints = classConstraints = [[LpConstraint() for c in range(self.C)] for i in range(2)]
         for c in range(self.C):    
             hardMin = self.sumStudentsInClass[c] - self.courseMins[c]*self.classWillRun[c]
-            hardMax = self.sumStudentsInClass[c] - self.courseMaxs[c]*self.classWillRun[c]
+            hardMax = self.sumStudentsInClass[c] - courseCapacities[c]*self.classWillRun[c]
             minConstraint = LpConstraint(e=hardMin, sense=1, name="C%dm"%c, rhs=0)
             maxConstraint = LpConstraint(e=hardMax, sense=-1, name="C%dM"%c, rhs=0)
             classConstraints[0][c] = minConstraint
             classConstraints[1][c] = maxConstraint
         
         #Constraint limiting the number of classes a student should be assigned to
-        maxAssignmentConstraint = [LpConstraint() for s in range(self.S)]
+        self.maxAssignmentConstraint = maxAssignmentConstraint = [LpConstraint() for s in range(self.S)]
         for s in range(self.S):
-            sumOfAssignments = LpAffineExpression()
-            for c in range(self.C):
-                sumOfAssignments += self.studentAssignments[s][c]
+            sumOfAssignments = lpSum(self.studentAssignments[s][c] for c in self.studentCourses[s])
             maxAssignmentConstraint[s] = sumOfAssignments <= 1
             
         #Constraint ensuring that a student gets assigned to one of there three preferences or no class
-        prefAssignmentConstraint = [LpConstraint() for s in range(self.S)]
-        for s in range(self.S):
-            sumOfNoPrefAssignments = LpAffineExpression()
-            for c in range(self.C):
-                if (self.studentPreferences[s][c] == 0):
-                    sumOfNoPrefAssignments += self.studentAssignments[s][c]
-            prefAssignmentConstraint[s] = sumOfNoPrefAssignments <= 0
+        #(a sparse model has no variables outside of the preferences, so it doesn't need these)
+        prefAssignmentConstraint = []
+        if not self.sparse:
+            choiceIndex = self.studentChoiceIndex.tolist()
+            for s in range(self.S):
+                sumOfNoPrefAssignments = lpSum(self.studentAssignments[s][c] for c in range(self.C)
+                                               if c not in choiceIndex[s])
+                prefAssignmentConstraint.append(sumOfNoPrefAssignments <= 0)
     
-        #Add constraints to model
-        for s in range(self.S):
-            self.model += maxAssignmentConstraint[s]
+        #Add constraints to model (a presolved model leaves out the empty rows of the students
+        #and courses that presolve removed, it isn't edited afterwards)
+        closedCourses = set(self.coursesThatCantRun().tolist()) if self.presolve and self.sparse else set()
         for s in range(self.S):
+            if len(self.studentCourses[s]) > 0 or not self.presolve:
+                self.model += maxAssignmentConstraint[s]
+        for s in range(len(prefAssignmentConstraint)):
             self.model += prefAssignmentConstraint[s]
         for c in range(self.C):
             #Dr. Miller's Constraints
             # for s in range(self.S):
             #     self.model += runConstraints[c][s]
             # self.model += sizeConstraints[c]
+            if c in closedCourses:
+                continue
             for i in range(len(classConstraints)):
                 self.model += classConstraints[i][c]
+        
+        if self.strengthen:
+            self.makeStrongConstraints()
+    
+    def makeStrongConstraints(self):
+        #Disaggregated linking cuts, only for the preferred pairs
+        for s, c in zip(self.pairStudent.tolist(), self.pairCourse.tolist()):
+            self.model += LpConstraint(e=self.studentAssignments[s][c] - self.classWillRun[c], sense=-1, name="C%dS%dr"%(c, s), rhs=0)
+        
+        #Symmetry breaking between students with the same choices
+        numRows, rowIds, pairs, coefficients = self.symmetryRows()
+        order = argsort(rowIds, kind="stable")
+        ends = searchsorted(rowIds[order], arange(1, numRows))
+        pairStudent, pairCourse = self.pairStudent.tolist(), self.pairCourse.tolist()
+        for row, (rowPairs, rowCoefficients) in enumerate(zip(split(pairs[order], ends), split(coefficients[order], ends))):
+            expression = lpSum(coefficient*self.studentAssignments[pairStudent[p]][pairCourse[p]]
+                               for p, coefficient in zip(rowPairs.tolist(), rowCoefficients.tolist()))
+            self.model += LpConstraint(e=expression, sense=1, name="Y%d"%row, rhs=0)
+
+
+
+
+class SoftConstraintMatcher(HardConstraintMatcher):
+    """
+    Course sizes are soft: a class that runs can be below its min or above its max, at a cost in
+    the objective for each student it is short (minPenalty) or over (maxPenalty):
+        sum(x) - min*run + short >= 0
+        sum(x) - max*run - over <= 0
+        maximize placement value - minPenalty*sum(short) - maxPenalty*sum(over)
+    maxPenalty = None keeps the max a hard constraint. These models are usually much easier for
+    CBC to close than the hard minimums, and the result says which courses to look at:
+    courseShort and courseOver are the number of students each course is short or over.
+    
+    solve(backend = "heuristic") still keeps every course that runs within its min and max (see
+    LocalSearch), so its solutions never pay a penalty and can be below the soft optimum.
+    
+    Example Usage:
+        matcher = SoftConstraintMatcher(minPenalty = 2, maxPenalty = None, ...same inputs...)
+    """
+    
+    optionAttributes = HardConstraintMatcher.optionAttributes + ("minPenalty", "maxPenalty")
+    modelAttributes = HardConstraintMatcher.modelAttributes + ("notSatisfyingMin", "overMaximum")
+    
+    def __init__(self, *args, minPenalty = 1, maxPenalty = 10, **kwargs):
+        self.minPenalty = minPenalty
+        self.maxPenalty = maxPenalty
+        super(SoftConstraintMatcher, self).__init__(*args, **kwargs)
+    
+    def coursesThatCantRun(self):
+        #A course below its min can still run when its mins are soft
+        return Matcher.coursesThatCantRun(self)
+    
+    def initVariables(self):
+        super(SoftConstraintMatcher, self).initVariables()
+        self.notSatisfyingMin = [LpVariable("C%ds"%c, 0) for c in range(self.C)]
+        self.overMaximum = [LpVariable("C%do"%c, 0) for c in range(self.C)] if self.maxPenalty is not None else []
+    
+    def makeObjective(self):
+        super(SoftConstraintMatcher, self).makeObjective()
+        self.model.objective.addInPlace(-self.minPenalty*lpSum(self.notSatisfyingMin))
+        if self.maxPenalty is not None:
+            self.model.objective.addInPlace(-self.maxPenalty*lpSum(self.overMaximum))
+    
+    def makeConstraints(self):
+        super(SoftConstraintMatcher, self).makeConstraints()
+        for c in range(self.C):
+            self.classConstraints[0][c].addInPlace(self.notSatisfyingMin[c])
+            if self.maxPenalty is not None:
+                self.classConstraints[1][c].addInPlace(-self.overMaximum[c])
+    
+    def setInitialValues(self, pairValues):
+        super(SoftConstraintMatcher, self).setInitialValues(pairValues)
+        courseSizes = bincount(self.pairCourse, weights=pairValues, minlength=self.C)
+        short, over = self.courseViolations(courseSizes)
+        for c in range(self.C):
+            self.notSatisfyingMin[c].setInitialValue(int(short[c]))
+            if self.maxPenalty is not None:
+                self.overMaximum[c].setInitialValue(int(over[c]))
+    
+    def makeMatrixModel(self):
+        super(SoftConstraintMatcher, self).makeMatrixModel()
+        self.notSatisfyingMinColumns = self.matrix.addColumns(zeros(self.C) - self.minPenalty, upper=inf, integer=False)
+        self.matrix.addEntries(self.minRows, self.notSatisfyingMinColumns, 1)
+        if self.maxPenalty is not None:
+            self.overMaximumColumns = self.matrix.addColumns(zeros(self.C) - self.maxPenalty, upper=inf, integer=False)
+            self.matrix.addEntries(self.maxRows, self.overMaximumColumns, -1)
+    
+    def repairAssignment(self, pairValues):
+        #Courses below their min only cost a penalty, so keeping them open may be the better repair
+        repairs = [self.greedyAssignment(pairValues, closeShortCourses) for closeShortCourses in (True, False)]
+        return max(repairs, key=self.assignmentValue)
+    
+    def assignmentValue(self, pairValues):
+        short, over = self.courseViolations(bincount(self.pairCourse, weights=pairValues, minlength=self.C).astype(int64))
+        #Exact with fractional penalties: an int only when the penalties are
+        penalty = self.minPenalty*int(short.sum()) + (self.maxPenalty or 0)*int(over.sum())
+        return super(SoftConstraintMatcher, self).assignmentValue(pairValues) - penalty
+    
+    def courseViolations(self, courseSizes):
+        #Students short of the min and over the max of each course that runs
+        courseSizes = asarray(courseSizes)
+        runs = courseSizes > 0
+        short = where(runs, (asarray(self.courseMins) - courseSizes).clip(0), 0)
+        over = where(runs, (courseSizes - asarray(self.courseMaxs)).clip(0), 0) if self.maxPenalty is not None else zeros(self.C)
+        return short, over
+    
+    def solve(self, solver = "PULP_CBC_CMD", backend = "pulp", **options):
+        super(SoftConstraintMatcher, self).solve(solver, backend, **options)
+        if self.pairValues is not None:
+            self.courseShort, self.courseOver = self.courseViolations(
+                bincount(self.pairCourse, weights=self.pairValues, minlength=self.C).astype(int64))
+            print("Students short of course minimums: %d, over course maximums: %d"
+                  % (self.courseShort.sum(), self.courseOver.sum()))
+
+
+
+
+class FlowMatcher(HardConstraintMatcher):
+    """
+    Without the classWillRun variables the problem is a transportation problem: each student
+    goes to at most one of their choices and each course takes at most its max. A min-cost
+    flow solves that exactly, with no branching:
+        student (supply 1) -> preferred course (cost -weight) -> sink (up to the course max)
+        student -> sink (cost 0) for students left unassigned
+    Each course reaches the sink through an arc for its first min students and one for the
+    rest, and a course can be kept open by moving its min capacity to a parallel arc with a
+    bonus, which pulls students into it until it is full to its min.
+    
+    Course minimums are then repaired greedily: the open course that is furthest below its
+    minimum is either kept open (filled to its min through the bonus) or closed, whichever
+    gives the better placement value, and the flow is solved again until every course that
+    runs is within its bounds. If nothing had to be repaired the result is optimal for the
+    hard constraints.
+    
+    Needs OR-Tools. solve(backend = "pulp") or "scipy" still solve the exact MIP.
+    """
+    
+    backends = dict(HardConstraintMatcher.backends, flow = "solveFlow")
+    portfolioBackends = dict(HardConstraintMatcher.portfolioBackends, flow = "ortools")
+    
+    def solve(self, solver = "PULP_CBC_CMD", backend = "flow", **options):
+        super(FlowMatcher, self).solve(solver, backend, **options)
+    
+    def makeFlow(self):
+        from ortools.graph.python.min_cost_flow import SimpleMinCostFlow
+        
+        P = len(self.pairStudent)
+        #A course whose min is above its max can't run (classWillRun = 0 in the MIP), so it gets no capacity
+        courseMins = asarray(self.courseMins, dtype=int64)
+        courseMaxs = asarray(self.courseMaxs, dtype=int64).clip(0)
+        canRun = courseMins <= courseMaxs
+        self.flowMins = where(canRun, courseMins.clip(0), 0)
+        self.flowRests = where(canRun, courseMaxs - self.flowMins, 0)
+        students = arange(self.S, dtype=int64)
+        courses = self.S + arange(self.C, dtype=int64)
+        sink = zeros(self.S, dtype=int64) + self.S + self.C
+        
+        #A bonus bigger than any student can lose by moving fills a kept course up to its min
+        bonus = 2*int(max(self.preferenceWeights)) + 1
+        
+        #Arcs: student -> preferred course, student -> sink, course -> sink (min, min with bonus, rest)
+        self.flow = SimpleMinCostFlow()
+        self.flow.add_arcs_with_capacity_and_unit_cost(
+            concatenate([self.pairStudent.astype(int64), students, courses, courses, courses]),
+            concatenate([self.S + self.pairCourse.astype(int64), sink, sink[:self.C], sink[:self.C], sink[:self.C]]),
+            concatenate([ones(P + self.S, dtype=int64), self.flowMins, zeros(self.C, dtype=int64), self.flowRests]),
+            concatenate([-self.pairWeight.astype(int64), zeros(self.S + self.C, dtype=int64),
+                         zeros(self.C, dtype=int64) - bonus, zeros(self.C, dtype=int64)]))
+        self.flow.set_nodes_supplies(concatenate([students, sink[:1]]), concatenate([ones(self.S, dtype=int64), [-self.S]]))
+        self.flowPairArcs = arange(P, dtype=int64)
+        self.flowMinArcs = P + self.S + arange(self.C, dtype=int64)
+        self.flowBonusArcs = self.flowMinArcs + self.C
+        self.flowRestArcs = self.flowBonusArcs + self.C
+    
+    def solveFlowOnce(self):
+        self.flowSolves += 1
+        if self.flow.solve() != self.flow.OPTIMAL:
+            raise RuntimeError("Min-cost flow could not be solved")
+        pairValues = self.flow.flows(self.flowPairArcs).astype(int8)
+        courseSizes = bincount(self.pairCourse, weights=pairValues, minlength=self.C).astype(int64)
+        return pairValues, courseSizes, int((self.pairWeight*pairValues).sum())
+    
+    def setCourseState(self, c, state):
+        #state is "open" (no bonus), "kept" (min capacity on the bonus arc) or "closed" (no capacity)
+        minCapacity = int(self.flowMins[c]) if state == "open" else 0
+        bonusCapacity = int(self.flowMins[c]) if state == "kept" else 0
+        restCapacity = 0 if state == "closed" else int(self.flowRests[c])
+        self.flow.set_arc_capacity(int(self.flowMinArcs[c]), minCapacity)
+        self.flow.set_arc_capacity(int(self.flowBonusArcs[c]), bonusCapacity)
+        self.flow.set_arc_capacity(int(self.flowRestArcs[c]), restCapacity)
+    
+    def solveFlow(self, solver, **options):
+        with self.report.phase("preferences"):
+            self.makePreferences()
+        with self.report.phase("flow"):
+            self.makeFlow()
+        self.report.modelSize = {"nodes": self.flow.num_nodes(), "arcs": self.flow.num_arcs()}
+        
+        with self.report.phase("solver"):
+            self.repairFlow()
+        self.report.solverStats = {"flowSolves": self.flowSolves, "flowBound": self.flowBound,
+                                   "keptCourses": len(self.keptCourses), "repairClosedCourses": len(self.repairClosedCourses)}
+        
+        self.status = "Optimal" if len(self.keptCourses) + len(self.repairClosedCourses) == 0 else "Feasible"
+        #Every solution that meets the course minimums is also a flow, so the first flow is a bound
+        self.bestBound = self.flowBound
+        self.objectiveValue = int((self.pairWeight*self.pairValues).sum())
+        print("Flow bound without course minimums: %d, courses kept open: %d, closed: %d"
+              % (self.flowBound, len(self.keptCourses), len(self.repairClosedCourses)))
+    
+    def repairFlow(self):
+        self.keptCourses = []
+        self.repairClosedCourses = []
+        self.flowSolves = 0
+        self.pairValues, courseSizes, self.flowBound = self.solveFlowOnce()
+        while True:
+            #Courses that run with fewer students than their min (a kept course may still not reach it)
+            shortCourses = flatnonzero((courseSizes > 0) & (courseSizes < self.flowMins))
+            if len(shortCourses) == 0:
+                break
+            c = int(shortCourses[argmin(courseSizes[shortCourses] / self.flowMins[shortCourses])])
+            
+            #Try keeping the course open unless that was already tried, then try closing it
+            options = []
+            if c not in self.keptCourses:
+                self.setCourseState(c, "kept")
+                pairValues, sizes, placement = self.solveFlowOnce()
+                if sizes[c] >= self.flowMins[c]:
+                    options.append((placement, "kept", pairValues, sizes))
+            self.setCourseState(c, "closed")
+            pairValues, sizes, placement = self.solveFlowOnce()
+            options.append((placement, "closed", pairValues, sizes))
+            
+            placement, state, self.pairValues, courseSizes = max(options, key=lambda option: option[0])
+            if state == "kept":
+                self.setCourseState(c, "kept")
+                self.keptCourses.append(c)
+            else:
+                if c in self.keptCourses:
+                    self.keptCourses.remove(c)
+                self.repairClosedCourses.append(c)
 
 
+def solveScenario(matcher, name, options):
+    #Runs in a worker process for runScenarios, with the solver's output kept quiet
+    with redirect_stdout(StringIO()):
+        start = perf_counter()
+        matcher.solve(**options)
+        seconds = perf_counter() - start
+    if matcher.status not in ("Optimal", "Feasible"):
+        return {"Scenario": name, "Status": matcher.status, "Objective": None, "First choice rate": None,
+                "Unassigned": None, "Solve seconds": seconds}
+    stats = matcher.results().stats
+    return {"Scenario": name, "Status": matcher.status, "Objective": matcher.objectiveValue,
+            "First choice rate": float(stats["First Choice Assignments"]) / matcher.S,
+            "Unassigned": stats["No Assignments"], "Solve seconds": seconds}
+
+def runScenarios(config, scenarios, matcherType = HardConstraintMatcher, workers = None):
+    """
+    Solves variants of one roster in parallel and returns a table comparing them. config has the
+    matcher's arguments as in config.json, and each scenario is a dict of overrides:
+        {"name": "Smaller classes", "Min": "Minimum/30", "Max": "Maximum/20",
+         "preferenceWeights": [4, 2, 1], "solve": {"backend": "scipy", "timeLimit": 60}}
+    Min and Max are other columns of the courses file and preferenceWeights are whole numbers
+    up to 127. The input is read once (the extra bound
+    columns in one more read of the courses file) and every scenario is solved in a pool of
+    worker processes (one per CPU by default), which share the CPUs out as solver threads unless
+    a scenario's solve gives threads. On Windows, call it under if __name__ == "__main__":
+    """
+    matcher = matcherType(**config)
+    
+    #Every bound column used by a scenario, read once
+    boundColumns = sorted({scenario[key] for scenario in scenarios for key in ("Min", "Max") if key in scenario})
+    bounds = {}
+    if boundColumns:
+        coursesFile, coursesSheet = matcher.coursesTable
+        table = matcher.readTable(coursesFile, coursesSheet, {column: column for column in boundColumns})
+        bounds = {column: table[column].to_numpy(dtype=int64, copy=True) for column in boundColumns}
+    
+    scenarioMatchers = []
+    names = []
+    options = []
+    for number, scenario in enumerate(scenarios):
+        scenarioMatcher = matcher.subMatcher(arange(matcher.S), arange(matcher.C))
+        if "Min" in scenario:
+            scenarioMatcher.courseMins = bounds[scenario["Min"]]
+        if "Max" in scenario:
+            scenarioMatcher.courseMaxs = bounds[scenario["Max"]]
+        name = scenario.get("name", "Scenario %d" % (number + 1))
+        if "preferenceWeights" in scenario:
+            #The pair weights are stored as int8
+            weights = scenario["preferenceWeights"]
+            if not all(isinstance(weight, (int, float)) and float(weight).is_integer() and -128 <= weight <= 127 for weight in weights):
+                raise ValueError("preferenceWeights of scenario '%s' must be whole numbers from -128 to 127, got %s" % (name, weights))
+            scenarioMatcher.preferenceWeights = tuple(int(weight) for weight in weights)
+        scenarioMatchers.append(scenarioMatcher)
+        names.append(name)
+        options.append(scenario.get("solve", {}))
+    
+    cpus = availableCpus()[0]
+    poolSize = min(workers or cpus, max(len(scenarios), 1))
+    options = [dict({"parallelSolves": poolSize}, **scenarioOptions) for scenarioOptions in options]
+    with ProcessPoolExecutor(max_workers = poolSize) as pool:
+        rows = list(pool.map(solveScenario, scenarioMatchers, names, options))
+    return DataFrame(rows, columns=["Scenario", "Status", "Objective", "First choice rate", "Unassigned", "Solve seconds"])
 
@@ -0,0 +1,39 @@
+'''
+Solves several variants of the roster in config.json in parallel and prints a comparison.
+
+    python scenarios.py scenarios.json
+    python scenarios.py scenarios.json --config config.json --workers 4 --output comparison.csv
+
+scenarios.json is a list of overrides of the config, e.g.:
+    [
+        {"name": "Test bounds", "Min": "Test Min", "Max": "Test Max"},
+        {"name": "Smaller classes", "Min": "Minimum/30", "Max": "Maximum/20"},
+        {"name": "Flatter weights", "preferenceWeights": [3, 2, 1]},
+        {"name": "HiGHS, 60s", "solve": {"backend": "scipy", "timeLimit": 60}}
+    ]
+Min and Max are columns of the courses file, preferenceWeights replaces 5/3/1 (whole numbers up to 127) and solve has
+the options passed to matcher.solve().
+'''
+
+from argparse import ArgumentParser
+from json import load
+
+from matcher import runScenarios
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Solve variants of one roster and compare them")
+    parser.add_argument("scenarios")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    arguments = parser.parse_args()
+
+    with open(arguments.config) as config_file:
+        config = load(config_file)
+    with open(arguments.scenarios) as scenarios_file:
+        scenarios = load(scenarios_file)
+
+    comparison = runScenarios(config, scenarios, workers = arguments.workers)
+    print(comparison.to_string(index=False))
+    if arguments.output is not None:
+        comparison.to_csv(arguments.output, index=False)